@@ -0,0 +1,92 @@
+import os
+import sys
+import shutil
+import random
+import sqlite3
+import datetime
+import tempfile
+import subprocess
+from urllib.parse import urlparse
+
+#Shared helpers for the benchmark scripts
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+#password every seeded benchmark user logs in with
+PASSWORD = "bench"
+
+#copy the real database (and its 29k row symbols table) into a scratch directory, returns its path
+def scratch_database():
+    scratch = tempfile.mkdtemp(prefix="stock-bench-")
+    path = os.path.join(scratch, "database.db")
+    shutil.copy(os.path.join(ROOT, "database.db"), path)
+    return path
+
+#add `users` users named bench0.. with `positions` holdings and `trades` transactions each,
+#returns the symbols each of them holds by username
+def seed(path, users, positions, trades, seed=0):
+    import migrations
+    from werkzeug.security import generate_password_hash
+
+    migrations.migrate(path)
+    rng = random.Random(seed)
+    con = sqlite3.connect(path)
+    symbols = con.execute("SELECT DISTINCT symbol, name FROM symbols WHERE symbol IS NOT NULL;").fetchall()
+    password_hash = generate_password_hash(PASSWORD)
+    start = datetime.datetime(2020, 1, 1)
+
+    for n in range(users):
+        cur = con.execute("INSERT INTO users (username, hash, cash) VALUES (?,?,?);", (f"bench{n}", password_hash, 1000000))
+        user_id = cur.lastrowid
+        held = rng.sample(symbols, positions)
+
+        con.executemany(
+            "INSERT INTO userStock (id, symbol, name, shares, avg_cost, realized_pnl, last_price) VALUES (?,?,?,?,?,0,?);",
+            [(user_id, symbol, name, rng.randint(1, 500), price, price) for (symbol, name), price in ((row, round(rng.uniform(5, 500), 2)) for row in held)]
+        )
+        ledger = []
+        for k in range(trades):
+            symbol, name = held[k % len(held)] if held else rng.choice(symbols)
+            when = start + datetime.timedelta(minutes=k * 37)
+            ledger.append((user_id, symbol, name, rng.choice([1, 1, 2, -1]) * rng.randint(1, 20), round(rng.uniform(5, 500), 2), when.strftime("%Y-%m-%d %H:%M:%S")))
+        con.executemany("INSERT INTO transactions (user_id, symbol, name, shares, price, time) VALUES (?,?,?,?,?,?);", ledger)
+    con.commit()
+
+    #symbols each benchmark user holds, so their buy/sell requests trade their own positions
+    held = {}
+    for username, symbol in con.execute("SELECT username, symbol FROM userStock JOIN users ON users.id = userStock.id WHERE username LIKE 'bench%' AND shares > 0;"):
+        held.setdefault(username, []).append(symbol)
+    con.close()
+    return held
+
+#whether a buy or sell went through, both only redirect to /account when the trade was made
+def traded(response):
+    location = response.headers.get("Location") or ""
+    return response.status_code == 302 and urlparse(location).path == "/account"
+
+#latency percentiles and throughput for one set of samples (seconds)
+def summarize(latencies, elapsed, errors=0):
+    latencies = sorted(latencies)
+    def pick(q):
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 3)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_sec": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": pick(0.50),
+        "p90_ms": pick(0.90),
+        "p99_ms": pick(0.99),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else None
+    }
+
+#commit and time of this run, so saved results can be compared later
+def run_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {"commit": commit or None, "time": datetime.datetime.now().isoformat(timespec="seconds"), "python": sys.version.split()[0]}
@@ -0,0 +1,122 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import threading
+import subprocess
+
+#Login throughput vs trade latency
+#
+#Runs the app on a threaded server over a seeded scratch database and measures buy/sell
+#latency on its own, then again while other clients log in as fast as they can. This
+#is done once with password hashing inline in the request threads (PASSWORD_WORKERS=0)
+#and once in the hashing process pool, each in a fresh process, and the results are
+#printed as JSON.
+#
+#    python benchmarks/logins.py --logins 16 --traders 4 --seconds 10
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import common
+
+#clients hitting base until stop, appending (latency, ok) to samples[kind]
+def trader(base, n, stop, samples, lock, held):
+    import requests
+    rng = random.Random(n)
+    client = requests.Session()
+    client.post(f"{base}/login", data={"username": f"bench{n}", "password": common.PASSWORD})
+    while time.monotonic() < stop:
+        route = rng.choice(["buy", "sell"])
+        started = time.perf_counter()
+        response = client.post(f"{base}/{route}", data={"symbol": rng.choice(held[f"bench{n}"]), "shares": "1"}, allow_redirects=False)
+        elapsed = time.perf_counter() - started
+        with lock:
+            samples["trades"].append((elapsed, common.traded(response)))
+
+def login_storm(base, n, stop, samples, lock):
+    import requests
+    client = requests.Session()
+    while time.monotonic() < stop:
+        started = time.perf_counter()
+        response = client.post(f"{base}/login", data={"username": f"bench{n}", "password": common.PASSWORD}, allow_redirects=False)
+        elapsed = time.perf_counter() - started
+        with lock:
+            samples["logins"].append((elapsed, response.headers.get("Location") == "/"))
+
+#one phase: traders always, login clients if logins > 0
+def phase(base, traders, logins, seconds, held):
+    samples = {"trades": [], "logins": []}
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+    threads = [threading.Thread(target=trader, args=(base, n, stop, samples, lock, held)) for n in range(traders)]
+    threads += [threading.Thread(target=login_storm, args=(base, traders + n, stop, samples, lock)) for n in range(logins)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    results = {}
+    for kind, values in samples.items():
+        if values or kind == "trades":
+            results[kind] = common.summarize([value[0] for value in values if value[1]], elapsed, sum(not value[1] for value in values))
+    return results
+
+#measure the current PASSWORD_WORKERS setting, in this process
+def measure(args):
+    from werkzeug.serving import make_server
+
+    path = common.scratch_database()
+    held = common.seed(path, args.traders + args.logins, 10, 0)
+    os.environ.update({"DATABASE": path, "MARKET_PROVIDER": "random", "QUOTE_POLL_INTERVAL": "0", "PASSWORD_LOCKOUT": "1"})
+
+    from main import app
+    import passwords
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    results = {
+        "password_workers": passwords.hasher.workers,
+        "password_method": passwords.hasher.method,
+        "trades_alone": phase(base, args.traders, 0, args.seconds, held),
+        "during_logins": phase(base, args.traders, args.logins, args.seconds, held)
+    }
+    server.shutdown()
+    passwords.hasher.shutdown()
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark login throughput against trade latency")
+    parser.add_argument("--logins", type=int, default=16, help="clients logging in continuously")
+    parser.add_argument("--traders", type=int, default=4, help="clients buying and selling")
+    parser.add_argument("--seconds", type=float, default=10, help="length of each phase")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="hashing processes for the pool run")
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args)))
+        return
+
+    #each setting in a fresh interpreter, PASSWORD_WORKERS is read at import
+    runs = {}
+    for label, workers in (("inline", 0), ("pool", args.workers)):
+        env = dict(os.environ, PASSWORD_WORKERS=str(workers))
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--measure", "--logins", str(args.logins), "--traders", str(args.traders), "--seconds", str(args.seconds)],
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+        runs[label] = json.loads(output.strip().splitlines()[-1])
+
+    print(json.dumps({"run": common.run_info(), "params": vars(args), "results": runs}, indent=2))
+
+if __name__ == "__main__":
+    main()
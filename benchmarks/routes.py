@@ -0,0 +1,154 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import threading
+
+#Latency and throughput of the trade and portfolio routes
+#
+#Seeds a scratch copy of the database with synthetic users, positions and transactions
+#(on top of the real symbols table), prices everything with the offline random-walk
+#provider and then measures each route twice: in-process through Flask's test client,
+#and over HTTP from several concurrent clients against a threaded server. Results are
+#printed (or written with --output) as JSON so runs can be compared over time.
+#
+#    python benchmarks/routes.py --users 50 --positions 30 --trades 2000 --output run.json
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import common
+
+ROUTES = ["account", "history", "sell_page", "buy", "sell", "home"]
+
+#one request per route, `client` is a Flask test client or a requests session, `options` go to every call
+def request(client, base, route, symbol, **options):
+    if route == "account":
+        return client.get(f"{base}/account", **options)
+    if route == "history":
+        return client.get(f"{base}/history", **options)
+    if route == "sell_page":
+        return client.get(f"{base}/sell", **options)
+    if route == "buy":
+        return client.post(f"{base}/buy", data={"symbol": symbol, "shares": "1"}, **options)
+    if route == "sell":
+        return client.post(f"{base}/sell", data={"symbol": symbol, "shares": "1"}, **options)
+    if route == "home":
+        return client.get(f"{base}/", **options)
+
+#trades count when they went through, pages when they rendered
+def ok(route, response):
+    if route in ("buy", "sell"):
+        return common.traded(response)
+    return response.status_code == 200
+
+#every route `iterations` times, one after another, through the test client
+def in_process(app, held, users, iterations, rng):
+    results = {}
+    clients = []
+    for n in range(min(users, 8)):
+        client = app.test_client()
+        client.post("/login", data={"username": f"bench{n}", "password": common.PASSWORD})
+        clients.append((client, held[f"bench{n}"]))
+
+    for route in ROUTES:
+        latencies = []
+        errors = 0
+        started = time.perf_counter()
+        for i in range(iterations):
+            client, symbols = clients[i % len(clients)]
+            before = time.perf_counter()
+            response = request(client, "", route, rng.choice(symbols))
+            latencies.append(time.perf_counter() - before)
+            if not ok(route, response):
+                errors += 1
+        results[route] = common.summarize(latencies, time.perf_counter() - started, errors)
+    return results
+
+#a weighted mix of routes from `workers` concurrent HTTP clients for `seconds`
+def over_http(app, held, users, workers, seconds, seed):
+    import requests
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    mix = ["account"] * 3 + ["history"] * 2 + ["sell_page", "buy", "sell", "home"]
+    samples = {route: [] for route in ROUTES}
+    errors = {route: 0 for route in ROUTES}
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def worker(n):
+        rng = random.Random(seed + n)
+        username = f"bench{n % users}"
+        client = requests.Session()
+        client.post(f"{base}/login", data={"username": username, "password": common.PASSWORD})
+        while time.monotonic() < stop:
+            route = rng.choice(mix)
+            before = time.perf_counter()
+            #time the trade itself, not rendering the page it redirects to
+            response = request(client, base, route, rng.choice(held[username]), allow_redirects=False)
+            elapsed = time.perf_counter() - before
+            with lock:
+                samples[route].append(elapsed)
+                if not ok(route, response):
+                    errors[route] += 1
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(workers)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    server.shutdown()
+
+    results = {route: common.summarize(samples[route], elapsed, errors[route]) for route in ROUTES}
+    results["total"] = common.summarize([s for route in ROUTES for s in samples[route]], elapsed, sum(errors.values()))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the trade and portfolio routes")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--positions", type=int, default=30, help="holdings per user")
+    parser.add_argument("--trades", type=int, default=1000, help="transactions per user")
+    parser.add_argument("--iterations", type=int, default=200, help="test client requests per route")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent HTTP clients")
+    parser.add_argument("--seconds", type=float, default=10, help="length of the HTTP run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    path = common.scratch_database()
+    held = common.seed(path, args.users, args.positions, args.trades, args.seed)
+    os.environ.update({
+        "DATABASE": path,
+        "MARKET_PROVIDER": "random",
+        "MARKET_SEED": str(args.seed),
+        "QUOTE_POLL_INTERVAL": os.environ.get("QUOTE_POLL_INTERVAL", "1")
+    })
+
+    from main import app
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    results = {
+        "run": common.run_info(),
+        "params": vars(args),
+        "test_client": in_process(app, held, args.users, args.iterations, random.Random(args.seed)),
+        "http": over_http(app, held, args.users, args.workers, args.seconds, args.seed)
+    }
+
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    print(report)
+
+if __name__ == "__main__":
+    main()
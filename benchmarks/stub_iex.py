@@ -0,0 +1,81 @@
+import os
+import json
+import time
+import random
+import datetime
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+#Local stand-in for the IEX cloud API
+#
+#Answers /stock/<symbol>/quote, /stock/<symbol>/chart and /stock/market/batch for any
+#symbol with made up prices, after an optional artificial delay, so benchmarks can
+#point IEX_BASE_URL at it instead of spending IEX credits.
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.calls += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        url = urlparse(self.path)
+        parts = url.path.rstrip("/").split("/")
+        if parts[-2:] == ["market", "batch"]:
+            symbols = parse_qs(url.query).get("symbols", [""])[0].split(",")
+            self.reply(200, {symbol.upper(): {"quote": self.quote(symbol)} for symbol in symbols if symbol})
+        elif "chart" in parts:
+            self.reply(200, self.chart(parts[parts.index("chart") - 1]))
+        elif len(parts) >= 3 and parts[-1] == "quote":
+            self.reply(200, self.quote(parts[-2]))
+        else:
+            self.reply(404, "Unknown symbol")
+
+    def quote(self, symbol):
+        symbol = symbol.upper()
+        #stable per symbol, wobbles a little per call
+        price = 10 + (sum(map(ord, symbol)) % 490) + random.uniform(-0.5, 0.5)
+        return {"companyName": f"{symbol} Inc", "latestPrice": round(price, 2), "symbol": symbol}
+
+    #five years of weekday closes following a seeded random walk
+    def chart(self, symbol):
+        walk = random.Random(symbol.upper())
+        price = 10 + (sum(map(ord, symbol.upper())) % 490)
+        day = datetime.date.today() - datetime.timedelta(days=5 * 365)
+        closes = []
+        while day <= datetime.date.today():
+            if day.weekday() < 5:
+                price = max(1.0, price * (1 + walk.gauss(0.0003, 0.02)))
+                closes.append({"date": day.isoformat(), "close": round(price, 2)})
+            day += datetime.timedelta(days=1)
+        return closes
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+#start a stub server in a background thread, returns (server, base url)
+def start(latency=0.0, port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.calls = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+if __name__ == "__main__":
+    server, url = start(latency=float(os.environ.get("STUB_LATENCY", 0)), port=8765)
+    print(f"stub IEX listening on {url}")
+    threading.Event().wait()
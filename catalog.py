@@ -0,0 +1,56 @@
+import os
+import threading
+
+#In-process catalog of the symbols table
+#
+#The categories and the companies in each category are loaded once and kept in memory.
+#Triggers on symbols bump its row in the versions table, so a cheap version check per
+#request is enough to notice when the catalog has to be reloaded.
+
+#companies shown per page of a category
+PAGE_SIZE = int(os.environ.get("CATALOG_PAGE_SIZE", 100))
+
+
+class Catalog:
+
+    def __init__(self):
+        self.version = None
+        self.categories = []
+        self.by_category = {}
+        self._lock = threading.Lock()
+
+    #reload from the database if symbols changed since the last load
+    def refresh(self, con):
+        version = data_version(con, "symbols")
+        if version == self.version:
+            return self
+
+        with self._lock:
+            if version != self.version:
+                by_category = {}
+                for row in con.execute("SELECT category, name, symbol FROM symbols ORDER BY category, symbol;"):
+                    by_category.setdefault(row[0], []).append(row)
+
+                #same shape as the old SELECT DISTINCT category rows
+                self.categories = [(category,) for category in by_category]
+                self.by_category = by_category
+                self.version = version
+        return self
+
+    #one page of companies in category, returns (rows, page, number of pages)
+    def page(self, category, page=1, per_page=PAGE_SIZE):
+        rows = self.by_category.get(category, [])
+        pages = max(1, -(-len(rows) // per_page))
+        page = min(max(page, 1), pages)
+        start = (page - 1) * per_page
+        return rows[start:start + per_page], page, pages
+
+
+#current version of a table tracked in the versions table
+def data_version(con, name):
+    row = con.execute("SELECT version FROM versions WHERE name = ?;", (name,)).fetchone()
+    return row[0] if row else 0
+
+
+#Process wide catalog used by the home page
+catalog = Catalog()
@@ -0,0 +1,106 @@
+import atexit
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from flask import g, current_app
+
+#Pooled SQLite connections
+#
+#Each database file has a bounded pool of idle connections. A request borrows one in
+#get_db() and gives it back at app context teardown, rolling back anything the route
+#left uncommitted, so routes no longer pay sqlite3.connect() on every hit. The pool
+#doesn't belong to any thread, so servers that start a thread per request (werkzeug's
+#threaded server) reuse the same few connections instead of opening new ones.
+#Connections handed back to a full pool are closed.
+
+#connection class used by connect(), instrumentation swaps in one that times queries
+connection_class = sqlite3.Connection
+_pools = {}
+_pools_lock = threading.Lock()
+
+#idle connections kept per database file unless DATABASE_POOL_SIZE says otherwise
+POOL_SIZE = 8
+
+#open and configure a connection
+def connect(path):
+    con = sqlite3.connect(path, timeout=10, cached_statements=256, check_same_thread=False, factory=connection_class)
+
+    #WAL lets readers carry on while /buy and /sell write
+    con.execute("PRAGMA journal_mode=WAL;")
+    con.execute("PRAGMA synchronous=NORMAL;")
+    con.execute("PRAGMA foreign_keys=ON;")
+    return con
+
+#borrow a pooled connection to the app's database for the current app context
+def get_db():
+    if "db" not in g:
+        path = current_app.config["DATABASE"]
+        if current_app.config["DATABASE_POOL"]:
+            g.db = _checkout(path, current_app.config["DATABASE_POOL_SIZE"])
+        else:
+            g.db = connect(path)
+    return g.db
+
+#hand the connection back at teardown
+def release_db(exception=None):
+    con = g.pop("db", None)
+    if con is None:
+        return
+    if con.in_transaction:
+        con.rollback()
+    if current_app.config["DATABASE_POOL"]:
+        _checkin(current_app.config["DATABASE"], con, current_app.config["DATABASE_POOL_SIZE"])
+    else:
+        con.close()
+
+#borrow a pooled connection outside of a request, handed back when the block exits
+@contextmanager
+def borrowed(path, size=POOL_SIZE):
+    con = _checkout(path, size)
+    try:
+        yield con
+    finally:
+        if con.in_transaction:
+            con.rollback()
+        _checkin(path, con, size)
+
+def _pool(path, size):
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = queue.LifoQueue(size)
+        return pool
+
+#most recently used idle connection, or a new one when none is idle
+def _checkout(path, size):
+    try:
+        return _pool(path, size).get_nowait()
+    except queue.Empty:
+        return connect(path)
+
+#keep the connection for the next request, or close it when the pool is full
+def _checkin(path, con, size):
+    try:
+        _pool(path, size).put_nowait(con)
+    except queue.Full:
+        con.close()
+
+#close every idle pooled connection, run at interpreter exit
+@atexit.register
+def close_all():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+def init_app(app):
+    app.config.setdefault("DATABASE", "database.db")
+    app.config.setdefault("DATABASE_POOL", True)
+    app.config.setdefault("DATABASE_POOL_SIZE", POOL_SIZE)
+    app.teardown_appcontext(release_db)
@@ -0,0 +1,130 @@
+import os
+import gzip
+import hashlib
+from functools import wraps
+from flask import request, session, make_response, url_for, current_app
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#HTTP caching and compression
+#
+#Instead of marking every response no-store, each kind of response gets its own policy:
+#
+#    static files   fingerprinted URLs (static_url() in templates adds ?v=<content hash>)
+#                   are cached for a year, plain /static URLs are revalidated every time
+#    @conditional   pages that only change with a data version (history, categories) get
+#                   an ETag (and Last-Modified where there is one) and answer 304 when
+#                   the browser's copy is still current, without rendering anything
+#    everything else  private, no-store, as before
+#
+#Nothing per user is ever public, so shared caches and proxies never store it. Large
+#text responses are gzip (or brotli, if installed) compressed for clients that accept it.
+
+#responses smaller than this aren't worth compressing
+MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+
+COMPRESSIBLE = {"text/html", "text/css", "text/plain", "text/csv", "application/javascript", "text/javascript", "application/json"}
+
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+_fingerprints = {}
+
+#hash of the files in folders, changes whenever a template or asset does
+def folder_hash(*folders):
+    digest = hashlib.sha1()
+    for folder in folders:
+        for root, dirs, files in sorted(os.walk(folder)):
+            dirs.sort()
+            for name in sorted(files):
+                with open(os.path.join(root, name), "rb") as f:
+                    digest.update(name.encode())
+                    digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+#templates and static files, part of every ETag so a deploy never serves stale markup
+release = ""
+
+#/static URL for filename with a content fingerprint, reloaded when the file changes
+def static_url(filename):
+    path = os.path.join(current_app.static_folder, filename)
+    stamp = os.stat(path).st_mtime_ns
+    cached = _fingerprints.get(filename)
+    if cached is None or cached[0] != stamp:
+        with open(path, "rb") as f:
+            cached = _fingerprints[filename] = (stamp, hashlib.sha1(f.read()).hexdigest()[:12])
+    return url_for("static", filename = filename, v = cached[1])
+
+#conditional GET for a view whose output only depends on key()
+#key() returns anything repr-able, last_modified() an optional naive local datetime
+def conditional(key, last_modified=None):
+    def decorate(f):
+        @wraps(f)
+        def wrap(*args, **kwargs):
+            #a pending flash message changes the page, so it has to be rendered
+            if request.method not in ("GET", "HEAD") or session.get("_flashes"):
+                return f(*args, **kwargs)
+
+            etag = hashlib.sha1(repr((release, request.full_path, key())).encode()).hexdigest()
+            modified = last_modified() if last_modified else None
+
+            if request.if_none_match:
+                fresh = request.if_none_match.contains_weak(etag)
+            else:
+                fresh = modified is not None and request.if_modified_since is not None and request.if_modified_since >= modified.astimezone().replace(microsecond=0)
+
+            response = make_response("", 304) if fresh else make_response(f(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag)
+                if modified is not None:
+                    response.last_modified = modified.astimezone()
+                response.headers["Cache-Control"] = "private, no-cache"
+            return response
+        return wrap
+    return decorate
+
+#after_request: cache policy for anything the view didn't set itself, then compression
+def finish(response):
+    if request.endpoint == "static":
+        if request.args.get("v"):
+            response.headers["Cache-Control"] = f"public, max-age={STATIC_MAX_AGE}, immutable"
+        else:
+            response.headers["Cache-Control"] = "public, no-cache"
+    elif "Cache-Control" not in response.headers:
+        response.headers["Cache-Control"] = "private, no-store"
+    return compress(response)
+
+def compress(response):
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        encoding = "br"
+    elif accepted["gzip"]:
+        encoding = "gzip"
+    else:
+        return response
+
+    data = response.get_data()
+    if len(data) < MIN_SIZE:
+        return response
+
+    response.set_data(brotli.compress(data, quality=5) if encoding == "br" else gzip.compress(data, compresslevel=6))
+    response.headers["Content-Encoding"] = encoding
+
+    #the compressed bytes differ, so the validator can only be a weak one
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+def init_app(app):
+    global release
+    release = folder_hash(os.path.join(app.root_path, app.template_folder), app.static_folder)
+    app.jinja_env.globals["static_url"] = static_url
+    app.after_request(finish)
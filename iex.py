@@ -0,0 +1,166 @@
+import os
+import time
+import random
+import threading
+import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter
+
+#IEX caps the batch endpoint at 100 symbols per call
+BATCH_SIZE = 100
+
+#status codes worth retrying, anything else is a final answer
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+#Fail fast once IEX keeps failing
+#
+#After `threshold` consecutive failures the breaker opens and every call is refused
+#for `reset_after` seconds. The first call after that is let through as a trial: a
+#success closes the breaker again, a failure re-opens it.
+class CircuitBreaker:
+
+    def __init__(self, threshold=5, reset_after=30.0):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self.opened_at < self.reset_after:
+                return False
+            self._trial = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if self._trial else "open"
+
+
+#Keep-alive HTTP client for the IEX cloud API
+class IEXClient:
+
+    def __init__(self, base_url="https://cloud.iexapis.com/stable", token=None, connect_timeout=3.05,
+                 read_timeout=5.0, retries=2, backoff=0.2, pool_size=20, breaker=None):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+
+        #one pooled session per client, connections are reused across requests and threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    #quote a single symbol, returns None if it is unknown or IEX is unavailable
+    def quote(self, symbol):
+        data = self.get(f"/stock/{urllib.parse.quote_plus(symbol)}/quote")
+        return parse_quote(data)
+
+    #quote up to BATCH_SIZE symbols in one call, returns {symbol: info or None} or None on failure
+    def quotes(self, symbols):
+        data = self.get("/stock/market/batch", {"symbols": ",".join(symbols), "types": "quote"})
+
+        #IEX keys the result by upper-case symbol
+        if not isinstance(data, dict):
+            return None
+        results = {}
+        for symbol in symbols:
+            entry = data.get(symbol.upper())
+            results[symbol] = parse_quote(entry.get("quote")) if isinstance(entry, dict) else None
+        return results
+
+    #daily closes for symbol over an IEX chart range (e.g. "5y"), returns [(YYYY-MM-DD, close)] or None
+    def chart(self, symbol, range="5y"):
+        data = self.get(f"/stock/{urllib.parse.quote_plus(symbol)}/chart/{range}", {"chartCloseOnly": "true"})
+        if not isinstance(data, list):
+            return None
+        try:
+            return [(day["date"], float(day["close"])) for day in data if day.get("close") is not None]
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    #GET a path and return the decoded JSON body, or None on any failure
+    def get(self, path, params=None):
+        if not self.breaker.allow():
+            return None
+
+        params = dict(params or {})
+        params["token"] = self.token if self.token is not None else os.environ.get("API_KEY")
+        url = self.base_url + path
+
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except requests.RequestException:
+                response = None
+
+            if response is not None and response.status_code not in RETRY_STATUS:
+                #IEX answered, a 4xx here means a bad symbol rather than an outage
+                self.breaker.success()
+                if not response.ok:
+                    return None
+                try:
+                    return response.json()
+                except ValueError:
+                    return None
+
+            #full jitter so retrying workers don't hit IEX in lockstep
+            if attempt < self.retries:
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+        self.breaker.failure()
+        return None
+
+
+#turn an IEX quote object into the dict used by the routes
+def parse_quote(quote):
+    try:
+        return {
+            "name": quote["companyName"],
+            "price": float(quote["latestPrice"]),
+            "symbol": quote["symbol"]
+        }
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+#Process wide client, point IEX_BASE_URL at a local stub server for testing
+iex_client = IEXClient(
+    base_url=os.environ.get("IEX_BASE_URL", "https://cloud.iexapis.com/stable"),
+    connect_timeout=float(os.environ.get("IEX_CONNECT_TIMEOUT", 3.05)),
+    read_timeout=float(os.environ.get("IEX_READ_TIMEOUT", 5)),
+    retries=int(os.environ.get("IEX_RETRIES", 2)),
+    breaker=CircuitBreaker(
+        threshold=int(os.environ.get("IEX_BREAKER_THRESHOLD", 5)),
+        reset_after=float(os.environ.get("IEX_BREAKER_RESET", 30))
+    )
+)
@@ -0,0 +1,423 @@
+import io
+import os
+import re
+import time
+import pstats
+import sqlite3
+import hmac
+import cProfile
+import ipaddress
+import threading
+import contextvars
+from collections import deque
+from flask import Blueprint, Response, request, g, jsonify, abort, before_render_template, template_rendered
+import database
+import market
+from quotes import quote_cache
+
+#Request instrumentation, switched on with INSTRUMENT=1
+#
+#Every request gets a RequestTiming that SQLite cursors, market data calls and template
+#renders add their time to, so a slow page can be split into database, quote and render
+#time (the Server-Timing header shows the split in the browser's network tab). Totals
+#are exported in the Prometheus text format at /metrics, the last requests with every
+#SQL statement they ran at /metrics/requests. The /metrics pages need the METRICS_TOKEN
+#bearer token when it is set, and are only served to loopback clients when it isn't.
+#
+#Sending an X-Profile header carrying PROFILE_TOKEN runs that one request under cProfile
+#and writes the stats to PROFILE_DIR (only the newest PROFILE_KEEP files are kept); the
+#response's X-Profile-File header names the file, and /metrics/profiles/<file> shows it
+#sorted by cumulative time. Without PROFILE_TOKEN the header is ignored.
+#
+#When INSTRUMENT is not set none of this is installed and requests run untouched.
+
+#request duration histogram buckets, seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#distinct statements tracked before new ones are lumped together
+MAX_STATEMENTS = 500
+
+_current = contextvars.ContextVar("request_timing", default=None)
+_labels = {}
+
+
+class RequestTiming:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db = 0.0
+        self.quote = 0.0
+        self.render = 0.0
+        self.queries = []
+        self.quotes = []
+        self.renders = []
+        self.rendering = []
+
+
+class Metrics:
+
+    def __init__(self, recent=100):
+        self.requests = {}
+        self.durations = {}
+        self.components = {}
+        self.statements = {}
+        self.quote_calls = {}
+        self.recent = deque(maxlen=recent)
+        self._lock = threading.Lock()
+
+    def observe_request(self, endpoint, method, status, elapsed, timing):
+        with self._lock:
+            key = (endpoint, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+            histogram = self.durations.get(endpoint)
+            if histogram is None:
+                histogram = self.durations[endpoint] = [0] * len(BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if elapsed <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += elapsed
+            histogram[-1] += 1
+
+            for component in ("db", "quote", "render"):
+                key = (endpoint, component)
+                self.components[key] = self.components.get(key, 0.0) + getattr(timing, component)
+
+            self.recent.append({
+                "endpoint": endpoint,
+                "method": method,
+                "path": request.path,
+                "status": status,
+                "ms": round(elapsed * 1000, 3),
+                "db_ms": round(timing.db * 1000, 3),
+                "quote_ms": round(timing.quote * 1000, 3),
+                "render_ms": round(timing.render * 1000, 3),
+                "queries": [{"sql": sql, "ms": round(seconds * 1000, 3)} for sql, seconds in timing.queries],
+                "quotes": [{"call": call, "ms": round(seconds * 1000, 3)} for call, seconds in timing.quotes],
+                "templates": [{"name": name, "ms": round(seconds * 1000, 3)} for name, seconds in timing.renders]
+            })
+
+    def observe_statement(self, sql, seconds):
+        with self._lock:
+            if sql not in self.statements and len(self.statements) >= MAX_STATEMENTS:
+                sql = "other"
+            entry = self.statements.get(sql)
+            if entry is None:
+                entry = self.statements[sql] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += seconds
+
+    def observe_fetch(self, sql, seconds):
+        with self._lock:
+            entry = self.statements.get(sql)
+            if entry is not None:
+                entry[1] += seconds
+
+    def observe_quote(self, call, seconds):
+        with self._lock:
+            entry = self.quote_calls.get(call)
+            if entry is None:
+                entry = self.quote_calls[call] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += seconds
+
+    #everything in the Prometheus text exposition format
+    def exposition(self):
+        lines = []
+        with self._lock:
+            lines += ["# HELP stock_http_requests_total Requests served.", "# TYPE stock_http_requests_total counter"]
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f"stock_http_requests_total{labels(endpoint=endpoint, method=method, status=status)} {count}")
+
+            lines += ["# HELP stock_http_request_duration_seconds Time to serve a request.", "# TYPE stock_http_request_duration_seconds histogram"]
+            for endpoint, histogram in sorted(self.durations.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram):
+                    cumulative += count
+                    lines.append(f"stock_http_request_duration_seconds_bucket{labels(endpoint=endpoint, le=repr(bound))} {cumulative}")
+                lines.append(f"stock_http_request_duration_seconds_bucket{labels(endpoint=endpoint, le='+Inf')} {histogram[-1]}")
+                lines.append(f"stock_http_request_duration_seconds_sum{labels(endpoint=endpoint)} {histogram[-2]:.6f}")
+                lines.append(f"stock_http_request_duration_seconds_count{labels(endpoint=endpoint)} {histogram[-1]}")
+
+            lines += ["# HELP stock_request_component_seconds_total Request time spent in the database, market data calls and templates.", "# TYPE stock_request_component_seconds_total counter"]
+            for (endpoint, component), seconds in sorted(self.components.items()):
+                lines.append(f"stock_request_component_seconds_total{labels(endpoint=endpoint, component=component)} {seconds:.6f}")
+
+            lines += ["# HELP stock_db_statements_total SQL statements executed.", "# TYPE stock_db_statements_total counter"]
+            lines += [f"stock_db_statements_total{labels(sql=sql)} {count}" for sql, (count, _) in sorted(self.statements.items())]
+            lines += ["# HELP stock_db_statement_seconds_total Time spent executing and fetching SQL statements.", "# TYPE stock_db_statement_seconds_total counter"]
+            lines += [f"stock_db_statement_seconds_total{labels(sql=sql)} {seconds:.6f}" for sql, (_, seconds) in sorted(self.statements.items())]
+
+            lines += ["# HELP stock_quote_calls_total Calls to the market data provider.", "# TYPE stock_quote_calls_total counter"]
+            lines += [f"stock_quote_calls_total{labels(call=call)} {count}" for call, (count, _) in sorted(self.quote_calls.items())]
+            lines += ["# HELP stock_quote_call_seconds_total Time spent waiting on the market data provider.", "# TYPE stock_quote_call_seconds_total counter"]
+            lines += [f"stock_quote_call_seconds_total{labels(call=call)} {seconds:.6f}" for call, (_, seconds) in sorted(self.quote_calls.items())]
+
+        stats = quote_cache.stats()
+        for name in ("hits", "misses", "stale"):
+            lines += [f"# TYPE stock_quote_cache_{name}_total counter", f"stock_quote_cache_{name}_total {stats[name]}"]
+        lines += ["# TYPE stock_quote_cache_size gauge", f"stock_quote_cache_size {stats['size']}"]
+        return "\n".join(lines) + "\n"
+
+
+#{key="value",...} with Prometheus escaping
+def labels(**values):
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in values.values())
+    return "{" + ",".join(f"{key}=\"{value}\"" for key, value in zip(values, escaped)) + "}"
+
+#one label per statement shape: whitespace collapsed and runs of placeholders folded
+def statement_label(sql):
+    label = _labels.get(sql)
+    if label is None:
+        label = re.sub(r"\?(\s*,\s*\?)+", "?, ...", " ".join(sql.split()))[:300]
+        if len(_labels) < 4 * MAX_STATEMENTS:
+            _labels[sql] = label
+    return label
+
+def record_statement(sql, seconds):
+    sql = statement_label(sql)
+    timing = _current.get()
+    if timing is not None:
+        timing.db += seconds
+        timing.queries.append((sql, seconds))
+    metrics.observe_statement(sql, seconds)
+
+def record_quote(call, seconds):
+    timing = _current.get()
+    if timing is not None:
+        timing.quote += seconds
+        timing.quotes.append((call, seconds))
+    metrics.observe_quote(call, seconds)
+
+
+#Cursor that times execute and fetch calls against the statement it ran
+class TimedCursor(sqlite3.Cursor):
+
+    def execute(self, sql, parameters=()):
+        self._sql = sql
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_statement(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, parameters):
+        self._sql = sql
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            record_statement(sql, time.perf_counter() - started)
+
+    def executescript(self, script):
+        self._sql = script
+        started = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            record_statement(script, time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._fetched(time.perf_counter() - started)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            self._fetched(time.perf_counter() - started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._fetched(time.perf_counter() - started)
+
+    #fetch time is added to the statement's total, not counted as another statement
+    def _fetched(self, seconds):
+        sql = statement_label(getattr(self, "_sql", ""))
+        timing = _current.get()
+        if timing is not None:
+            timing.db += seconds
+        metrics.observe_fetch(sql, seconds)
+
+
+#Connection whose cursors (including the ones behind con.execute) are TimedCursors
+class TimedConnection(sqlite3.Connection):
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+
+#Market data provider wrapper that times every call
+class TimedProvider:
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    def __getattr__(self, name):
+        return getattr(self.provider, name)
+
+    def _timed(self, call, *args):
+        started = time.perf_counter()
+        try:
+            return getattr(self.provider, call)(*args)
+        finally:
+            record_quote(call, time.perf_counter() - started)
+
+    def quote(self, symbol):
+        return self._timed("quote", symbol)
+
+    def quotes(self, symbols):
+        return self._timed("quotes", symbols)
+
+    def chart(self, symbol, range="5y"):
+        return self._timed("chart", symbol, range)
+
+
+def start_request():
+    g.timing = RequestTiming()
+    g.timing_token = _current.set(g.timing)
+
+    value = request.headers.get("X-Profile")
+    if value and PROFILE_TOKEN and hmac.compare_digest(value, PROFILE_TOKEN) and _profiling.acquire(blocking=False):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+def finish_request(response):
+    timing = g.pop("timing", None)
+    if timing is None:
+        return response
+    elapsed = time.perf_counter() - timing.started
+
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        _profiling.release()
+        response.headers["X-Profile-File"] = dump_profile(profiler)
+
+    metrics.observe_request(request.endpoint or "unmatched", request.method, response.status_code, elapsed, timing)
+    response.headers["Server-Timing"] = ", ".join([
+        f"db;dur={timing.db * 1000:.2f};desc=\"{len(timing.queries)} queries\"",
+        f"quote;dur={timing.quote * 1000:.2f};desc=\"{len(timing.quotes)} calls\"",
+        f"render;dur={timing.render * 1000:.2f}",
+        f"total;dur={elapsed * 1000:.2f}"
+    ])
+    return response
+
+def end_request(exception=None):
+    token = g.pop("timing_token", None)
+    if token is not None:
+        _current.reset(token)
+    #a request that failed before after_request still has to give the profiler back
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        _profiling.release()
+
+def render_started(sender, template, context, **extra):
+    timing = _current.get()
+    if timing is not None:
+        timing.rendering.append(time.perf_counter())
+
+def render_finished(sender, template, context, **extra):
+    timing = _current.get()
+    if timing is not None and timing.rendering:
+        seconds = time.perf_counter() - timing.rendering.pop()
+        #a template rendered while another one is rendering only counts once
+        if not timing.rendering:
+            timing.render += seconds
+        timing.renders.append((template.name, seconds))
+
+#write a profile to PROFILE_DIR, returns the file name
+def dump_profile(profiler):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    endpoint = re.sub(r"[^\w.-]", "_", request.endpoint or "unmatched")
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{endpoint}.prof"
+    profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+    prune_profiles()
+    return name
+
+#delete all but the newest PROFILE_KEEP profiles
+def prune_profiles():
+    names = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith(".prof"))
+    for name in names[:-PROFILE_KEEP]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except OSError:
+            pass
+
+
+instrumentation = Blueprint("instrumentation", __name__, url_prefix="/metrics")
+
+#request paths and SQL of every user: METRICS_TOKEN as a bearer token, or loopback clients only without one
+@instrumentation.before_request
+def metrics_access():
+    if METRICS_TOKEN:
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+            abort(401)
+        return
+    try:
+        loopback = ipaddress.ip_address(request.remote_addr or "").is_loopback
+    except ValueError:
+        loopback = False
+    if not loopback:
+        abort(403)
+
+@instrumentation.route("")
+def prometheus():
+    return Response(metrics.exposition(), mimetype="text/plain; version=0.0.4")
+
+@instrumentation.route("/requests")
+def recentRequests():
+    return jsonify(list(metrics.recent))
+
+@instrumentation.route("/profiles/<name>")
+def profile(name):
+    path = os.path.join(PROFILE_DIR, os.path.basename(name))
+    if not name.endswith(".prof") or not os.path.exists(path):
+        abort(404)
+
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(request.args.get("limit", 60, type=int))
+    return Response(out.getvalue(), mimetype="text/plain")
+
+
+#hook the database, market data provider, templates and request cycle into app
+def init_app(app):
+    database.connection_class = TimedConnection
+    if not isinstance(market.provider, TimedProvider):
+        market.provider = TimedProvider(market.provider)
+
+    before_render_template.connect(render_started, app)
+    template_rendered.connect(render_finished, app)
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.teardown_request(end_request)
+    app.register_blueprint(instrumentation)
+
+
+#Process wide metrics
+metrics = Metrics(recent=int(os.environ.get("INSTRUMENT_RECENT", 100)))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
+PROFILE_KEEP = max(1, int(os.environ.get("PROFILE_KEEP", 100)))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+#cProfile can only run one profile at a time
+_profiling = threading.Lock()
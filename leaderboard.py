@@ -0,0 +1,216 @@
+import logging
+import sqlite3
+import threading
+from bisect import bisect_left, insort
+import database
+from quotes import quote_cache
+
+#Portfolio value leaderboard
+#
+#Every user's value (cash plus shares at the latest price) is kept in memory together
+#with a sorted list of (-value, user_id), so the top of the board and any one user's
+#rank are a slice and a binary search, however many users there are.
+#
+#Values are only recomputed when something moves them:
+#
+#    price changes  each changed symbol is priced once per refresh of the price table,
+#                   and only the users holding it are revalued
+#    trades         triggers on users and userStock bump the user's row in the
+#                   leaderboard table, every process picks those rows up (by the change
+#                   counter) and reloads just those accounts
+#
+#Nothing here calls the quote provider: stocks that neither the price table nor the quote
+#cache has a price for yet are valued at their last traded price. Values that changed are written back to the
+#leaderboard table whenever the price table refreshes, so the ranking can also be read
+#with SQL; page views only read.
+
+log = logging.getLogger(__name__)
+
+#users reloaded per query when catching up on changed accounts
+RELOAD_BATCH = 500
+
+
+class Leaderboard:
+
+    def __init__(self, path):
+        self.path = path
+        self.con = None
+        self.table = None
+        self._names = {}
+        self._cash = {}
+        self._positions = {}
+        self._holders = {}
+        self._prices = {}
+        self._traded = set()
+        self._values = {}
+        self._ranked = []
+        self._seen = 0
+        self._dirty = set()
+        self._lock = threading.RLock()
+
+    #load every account and start revaluing on price changes in table
+    def start(self, table):
+        with self._lock:
+            if self.con is None:
+                self.con = database.connect(self.path)
+                self.table = table
+                self.sync()
+                self.save()
+                table.subscribe(self.on_prices)
+        return self
+
+    #reload the accounts changed since the last sync, by this process or any other
+    def sync(self):
+        rows = self.con.execute("SELECT user_id, changed FROM leaderboard WHERE changed > ? ORDER BY changed;", (self._seen,)).fetchall()
+        if not rows:
+            return 0
+        self._seen = rows[-1][1]
+
+        user_ids = list({user_id for user_id, changed in rows})
+        for start in range(0, len(user_ids), RELOAD_BATCH):
+            self._reload(user_ids[start:start + RELOAD_BATCH])
+        return len(user_ids)
+
+    def _reload(self, user_ids):
+        marks = ",".join("?" * len(user_ids))
+        accounts = self.con.execute(f"SELECT id, username, cash FROM users WHERE id IN ({marks});", user_ids).fetchall()
+        positions = self.con.execute(f"SELECT id, symbol, shares, last_price FROM userStock WHERE id IN ({marks}) AND shares > 0;", user_ids).fetchall()
+
+        for user_id in user_ids:
+            self._drop_positions(user_id)
+            self._names.pop(user_id, None)
+            self._cash.pop(user_id, None)
+
+        for user_id, username, cash in accounts:
+            self._names[user_id] = username
+            self._cash[user_id] = float(cash)
+            self._positions[user_id] = {}
+
+        touched = set(user_ids)
+        for user_id, symbol, shares, last_price in positions:
+            if user_id not in self._positions:
+                continue
+            self._positions[user_id][symbol] = shares
+            self._holders.setdefault(symbol, {})[user_id] = shares
+            if symbol in self._prices and symbol not in self._traded:
+                continue
+
+            #price it from the table, or at the last trade until the table has it
+            quote = self._quote(symbol)
+            if quote is not None:
+                self._traded.discard(symbol)
+                if self._prices.get(symbol) != quote["price"]:
+                    self._prices[symbol] = quote["price"]
+                    touched.update(self._holders[symbol])
+            elif symbol not in self._prices:
+                self._traded.add(symbol)
+                self._prices[symbol] = float(last_price or 0)
+
+        for user_id in touched:
+            if user_id in self._cash:
+                self._revalue(user_id)
+            else:
+                self._set_value(user_id, None)
+
+    #the latest quote already in memory for symbol, or None
+    def _quote(self, symbol):
+        quote = self.table.get(symbol) if self.table is not None else None
+        return quote if quote is not None else quote_cache.peek(symbol)
+
+    #forget user_id's positions, and the price of any symbol nobody holds any more
+    def _drop_positions(self, user_id):
+        for symbol in self._positions.pop(user_id, {}):
+            holders = self._holders.get(symbol)
+            if holders is not None:
+                holders.pop(user_id, None)
+                if not holders:
+                    del self._holders[symbol]
+                    self._prices.pop(symbol, None)
+                    self._traded.discard(symbol)
+
+    def _revalue(self, user_id):
+        prices = self._prices
+        value = self._cash[user_id] + sum(shares * prices[symbol] for symbol, shares in self._positions[user_id].items())
+        self._set_value(user_id, round(value, 2))
+
+    #move user_id to value in the sorted index, None takes them off the board
+    def _set_value(self, user_id, value):
+        old = self._values.get(user_id)
+        if old == value:
+            return
+        if old is not None:
+            del self._ranked[bisect_left(self._ranked, (-old, user_id))]
+        if value is None:
+            del self._values[user_id]
+        else:
+            self._values[user_id] = value
+            insort(self._ranked, (-value, user_id))
+            self._dirty.add(user_id)
+
+    #price table subscriber, revalues the holders of every changed symbol
+    def on_prices(self, changed):
+        with self._lock:
+            if self.con is None:
+                return 0
+            self.sync()
+            touched = set()
+            for symbol, quote in changed.items():
+                holders = self._holders.get(symbol)
+                if not holders:
+                    continue
+                self._traded.discard(symbol)
+                if self._prices.get(symbol) != quote["price"]:
+                    self._prices[symbol] = quote["price"]
+                    touched.update(holders)
+            for user_id in touched:
+                self._revalue(user_id)
+            self.save()
+            return len(touched)
+
+    #write the values that changed since the last save
+    def save(self):
+        if not self._dirty:
+            return
+        rows = [(self._values[user_id], user_id) for user_id in self._dirty if user_id in self._values]
+        self._dirty.clear()
+        try:
+            with self.con:
+                self.con.executemany("UPDATE leaderboard SET value = ? WHERE user_id = ?;", rows)
+        except sqlite3.OperationalError:
+            #the database is busy, the in-memory board is still right and the next save rewrites these
+            log.warning("couldn't save %d leaderboard values", len(rows))
+            self._dirty.update(user_id for value, user_id in rows)
+
+    #the n most valuable accounts as [(rank, username, value)], tied values share a rank
+    def top(self, n=10):
+        with self._lock:
+            if self.con is not None:
+                self.sync()
+            board = []
+            for position, (value, user_id) in enumerate(self._ranked[:n]):
+                rank = board[-1][0] if board and -value == board[-1][2] else position + 1
+                board.append((rank, self._names[user_id], -value))
+            return board
+
+    #(rank, value) of user_id, or None if they aren't on the board
+    def rank(self, user_id):
+        with self._lock:
+            if self.con is not None:
+                self.sync()
+            value = self._values.get(user_id)
+            if value is None:
+                return None
+            return bisect_left(self._ranked, (-value,)) + 1, value
+
+    def __len__(self):
+        return len(self._ranked)
+
+
+#Process wide board, started by main.py
+board = None
+
+def start_board(path, table):
+    global board
+    if board is None:
+        board = Leaderboard(path).start(table)
+    return board
@@ -0,0 +1,74 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from trades import TIME_FORMAT
+
+#Reading the transactions ledger
+#
+#Rows are walked newest first straight off a SQLite cursor, so neither a history page
+#nor a full export ever holds more than a page of rows in memory. Pages are keyed on
+#rowid (before=<rowid of the last row shown>) rather than OFFSET, so deep pages cost
+#the same as the first one.
+
+#transactions per history page
+PAGE_SIZE = 50
+
+#columns shown and exported, in order
+COLUMNS = ("symbol", "name", "shares", "price", "time")
+
+#parse a YYYY-MM-DD filter value, returns None if missing or invalid
+def parse_date(value):
+    try:
+        return datetime.strptime(value.strip(), "%Y-%m-%d")
+    except (AttributeError, ValueError):
+        return None
+
+#yield (rowid, symbol, name, shares, price, time) for user_id, newest first
+#start and end are dates, both inclusive
+def iter_transactions(con, user_id, symbol=None, start=None, end=None, before=None):
+    sql = "SELECT rowid, symbol, name, shares, price, time FROM transactions WHERE user_id = ?"
+    params = [user_id]
+    if symbol:
+        sql += " AND symbol = ?"
+        params.append(symbol)
+
+    #times are ISO-8601 text, so a date range is a plain string range on the index
+    if start:
+        sql += " AND time >= ?"
+        params.append(start.strftime(TIME_FORMAT))
+    if end:
+        sql += " AND time < ?"
+        params.append((end + timedelta(days=1)).strftime(TIME_FORMAT))
+    if before is not None:
+        sql += " AND rowid < ?"
+        params.append(before)
+    sql += " ORDER BY rowid DESC;"
+
+    return con.cursor().execute(sql, params)
+
+#one page of history, returns (rows, rowid to continue before or None on the last page)
+def history_page(con, user_id, symbol=None, start=None, end=None, before=None, size=PAGE_SIZE):
+    rows = []
+    for row in iter_transactions(con, user_id, symbol, start, end, before):
+        if len(rows) == size:
+            return rows, rows[-1][0]
+        rows.append(row)
+    return rows, None
+
+#stream rows as CSV text, one chunk per row
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for row in rows:
+        writer.writerow(row[1:])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+#stream rows as newline delimited JSON objects
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(COLUMNS, row[1:]))) + "\n"
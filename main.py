@@ -1,33 +1,57 @@
 import os
 from logging import debug
 from flask import Flask, session
-from flask_session import Session
-from tempfile import mkdtemp
 from views import views
+import database
+import sessions
+import httpcache
+import migrations
+import prices
+import orders
+import leaderboard
+import market
 
 #Configure application
 app = Flask(__name__)
 
-#Make sure API key is set
-if not os.environ.get("API_KEY"):
+#Make sure API key is set when quoting live from IEX (MARKET_PROVIDER=replay or random runs offline)
+if market.provider.remote and not os.environ.get("API_KEY"):
     raise RuntimeError("API_KEY not set")
 
 #Ensure templates are auto-reloaded
 app.config['TEMPLATES_AUTO_RELOAD'] = True
 
-#Ensure responses aren't cached
-@app.after_request
-def after_request(response):
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Expires"] = 0
-    response.headers["Pragma"] = "no-cache"
-    return response
-
-#Configure session to use filesystem(instead of signed cookies)
-app.config["SESSION_FILE_DIR"] = mkdtemp()
-app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+#Cache policy per kind of response (private pages are never stored), ETags and compression, see httpcache.py
+httpcache.init_app(app)
+
+#Configure pooled database connections
+app.config["DATABASE"] = os.environ.get("DATABASE", "database.db")
+database.init_app(app)
+
+#Per request timings, /metrics and X-Profile request profiling (INSTRUMENT=1)
+if os.environ.get("INSTRUMENT"):
+    import instrumentation
+    instrumentation.init_app(app)
+
+#Bring the schema up to date
+migrations.migrate(app.config["DATABASE"])
+
+#Keep sessions server side (instead of signed cookies) where every worker can see them, see sessions.py
+app.session_interface = sessions.make_interface(app.config["DATABASE"])
+
+#Offline providers take company names from the symbols table
+market.provider.load_names(app.config["DATABASE"])
+
+#Background threads, left out of the password hashing processes (passwords.py), which re-import this file as __mp_main__ under `python main.py`
+if __name__ != "__mp_main__":
+    #Refresh held and recently quoted stocks in the background (QUOTE_POLL_INTERVAL=0 turns it off)
+    prices.start_poller(app.config["DATABASE"])
+
+    #Fill resting limit and stop orders as prices move
+    orders.start_engine(app.config["DATABASE"], prices.price_table)
+
+    #Keep the portfolio value leaderboard current as prices and accounts change
+    leaderboard.start_board(app.config["DATABASE"], prices.price_table)
 
 #Register blueprint
 app.register_blueprint(views)
@@ -0,0 +1,204 @@
+import os
+import csv
+import time
+import random
+import sqlite3
+import datetime
+import threading
+from bisect import bisect_right
+import numpy as np
+from iex import iex_client
+from pricestore import price_store, bar_dates
+
+#Market data providers
+#
+#Everything that needs a price goes through `provider`, picked by MARKET_PROVIDER:
+#
+#    iex     live quotes from IEX cloud (the default, needs API_KEY)
+#    replay  recorded ticks (REPLAY_FILE, a time,symbol,price CSV) or the daily closes in
+#            the local price store, replayed REPLAY_SPEED times faster than real time
+#    random  a seeded random walk per symbol (MARKET_SEED), one step per MARKET_STEP seconds
+#
+#Every provider answers quote(symbol), quotes(symbols) and chart(symbol, range) in the
+#same shapes as the IEX client, returning None for symbols it doesn't know.
+
+
+class IEXProvider:
+    remote = True
+
+    def quote(self, symbol):
+        return iex_client.quote(symbol)
+
+    def quotes(self, symbols):
+        return iex_client.quotes(symbols)
+
+    def chart(self, symbol, range="5y"):
+        return iex_client.chart(symbol, range)
+
+    def load_names(self, path):
+        pass
+
+
+class LocalProvider:
+    remote = False
+
+    def __init__(self):
+        self.names = {}
+
+    #company names for quotes, from the symbols table
+    def load_names(self, path):
+        con = sqlite3.connect(path)
+        try:
+            self.names = {symbol.upper(): name for symbol, name in con.execute("SELECT symbol, name FROM symbols WHERE symbol IS NOT NULL;")}
+        finally:
+            con.close()
+
+    def known(self, symbol):
+        return not self.names or symbol in self.names
+
+    def make_quote(self, symbol, price):
+        return {"name": self.names.get(symbol, symbol), "price": round(float(price), 2), "symbol": symbol}
+
+    def quotes(self, symbols):
+        return {symbol: self.quote(symbol) for symbol in symbols}
+
+
+class ReplayProvider(LocalProvider):
+
+    #ticks is {symbol: (sorted epoch seconds, prices)}, replayed from the earliest tick onwards
+    def __init__(self, ticks, speed=1.0, clock=time.monotonic):
+        super().__init__()
+        self.ticks = ticks
+        self.speed = speed
+        self.clock = clock
+        self.started = clock()
+        stamps = [series[0][0] for series in ticks.values() if series[0]]
+        self.first = min(stamps) if stamps else 0.0
+        last = max((series[0][-1] for series in ticks.values() if series[0]), default=self.first)
+
+        #the last tick is held for one recording interval before wrapping around
+        gaps = [b - a for series in ticks.values() for a, b in zip(series[0], series[0][1:]) if b > a]
+        self.span = last - self.first + (min(gaps) if gaps else 1.0)
+
+    #recorded ticks from a time,symbol,price CSV, time as epoch seconds or ISO-8601
+    @classmethod
+    def from_csv(cls, path, **kwargs):
+        series = {}
+        with open(path, newline="") as f:
+            for record in csv.DictReader(f):
+                stamp = record["time"].strip()
+                try:
+                    stamp = float(stamp)
+                except ValueError:
+                    stamp = datetime.datetime.fromisoformat(stamp).timestamp()
+                series.setdefault(record["symbol"].strip().upper(), []).append((stamp, float(record["price"])))
+
+        ticks = {}
+        for symbol, rows in series.items():
+            rows.sort()
+            ticks[symbol] = ([row[0] for row in rows], [row[1] for row in rows])
+        return cls(ticks, **kwargs)
+
+    #one tick per daily close for every symbol in the local price store
+    @classmethod
+    def from_store(cls, store, **kwargs):
+        ticks = {}
+        if os.path.isdir(store.path):
+            for name in os.listdir(store.path):
+                if name.endswith(".npy"):
+                    bars = store.bars(name[:-4])
+                    seconds = bar_dates(bars).astype("datetime64[s]").astype(np.int64)
+                    ticks[name[:-4]] = (seconds.astype(float).tolist(), np.asarray(bars["close"]).tolist())
+        return cls(ticks, **kwargs)
+
+    #the recorded moment being replayed right now, wrapping around at the end
+    def now(self):
+        return self.first + ((self.clock() - self.started) * self.speed) % self.span
+
+    def quote(self, symbol):
+        symbol = symbol.upper()
+        series = self.ticks.get(symbol)
+        if series is None or not series[0]:
+            return None
+        i = max(bisect_right(series[0], self.now()) - 1, 0)
+        return self.make_quote(symbol, series[1][i])
+
+    def chart(self, symbol, range="5y"):
+        series = self.ticks.get(symbol.upper())
+        if series is None:
+            return None
+        closes = {}
+        for stamp, price in zip(*series):
+            if stamp <= self.now():
+                closes[datetime.date.fromtimestamp(stamp).isoformat()] = price
+        return sorted(closes.items())
+
+
+class RandomWalkProvider(LocalProvider):
+
+    def __init__(self, seed=0, step=1.0, volatility=0.002, clock=time.monotonic):
+        super().__init__()
+        self.seed = seed
+        self.step = step
+        self.volatility = volatility
+        self.clock = clock
+        self.started = clock()
+        self._walks = {}
+        self._lock = threading.Lock()
+
+    #starting price and generator for symbol, the same for a given seed every run
+    def _walk(self, symbol):
+        walk = self._walks.get(symbol)
+        if walk is None:
+            rng = random.Random(f"{self.seed}:{symbol}")
+            walk = self._walks[symbol] = [0, 10 + rng.random() * 490, rng]
+        return walk
+
+    def quote(self, symbol):
+        symbol = symbol.upper()
+        if not self.known(symbol):
+            return None
+
+        steps = int((self.clock() - self.started) / self.step)
+        with self._lock:
+            walk = self._walk(symbol)
+            while walk[0] < steps:
+                walk[1] = max(0.01, walk[1] * (1 + walk[2].gauss(0, self.volatility)))
+                walk[0] += 1
+            return self.make_quote(symbol, walk[1])
+
+    #five years of weekday closes ending at the current price
+    def chart(self, symbol, range="5y"):
+        symbol = symbol.upper()
+        quote = self.quote(symbol)
+        if quote is None:
+            return None
+        rng = random.Random(f"{self.seed}:{symbol}:chart")
+        price = quote["price"]
+        day = datetime.date.today()
+        closes = []
+        while len(closes) < 5 * 252:
+            if day.weekday() < 5:
+                closes.append((day.isoformat(), round(price, 2)))
+                price = max(0.01, price / (1 + rng.gauss(0.0003, 0.02)))
+            day -= datetime.timedelta(days=1)
+        return closes[::-1]
+
+
+#provider chosen by MARKET_PROVIDER
+def make_provider(kind=None):
+    kind = (kind or os.environ.get("MARKET_PROVIDER", "iex")).lower()
+    if kind == "iex":
+        return IEXProvider()
+    if kind == "replay":
+        speed = float(os.environ.get("REPLAY_SPEED", 1))
+        if os.environ.get("REPLAY_FILE"):
+            return ReplayProvider.from_csv(os.environ["REPLAY_FILE"], speed=speed)
+        return ReplayProvider.from_store(price_store, speed=speed)
+    if kind == "random":
+        return RandomWalkProvider(seed=os.environ.get("MARKET_SEED", "0"), step=float(os.environ.get("MARKET_STEP", 1)))
+    raise RuntimeError(f"Unknown MARKET_PROVIDER {kind!r}")
+
+
+#Process wide provider
+provider = make_provider()
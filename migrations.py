@@ -0,0 +1,233 @@
+import sys
+import sqlite3
+
+#Versioned schema migrations
+#
+#The schema version lives in SQLite's user_version pragma. migrate() applies every
+#migration newer than it, each one in its own transaction together with the version
+#bump, so a failed migration leaves the database exactly as it was. The version is
+#read again once the write lock is held, so when several workers start together only
+#the first applies each migration.
+
+MIGRATIONS = []
+
+#register a function as the migration to schema version `version`
+def migration(version):
+    def register(f):
+        MIGRATIONS.append((version, f))
+        MIGRATIONS.sort()
+        return f
+    return register
+
+#bring the database at path (or an open connection) up to the latest version
+def migrate(target):
+    con = sqlite3.connect(target, timeout=60) if isinstance(target, str) else target
+    try:
+        current = con.execute("PRAGMA user_version;").fetchone()[0]
+        for version, apply in MIGRATIONS:
+            if version <= current:
+                continue
+            con.execute("BEGIN IMMEDIATE;")
+            try:
+                #another process may have got here first
+                current = con.execute("PRAGMA user_version;").fetchone()[0]
+                if version <= current:
+                    con.commit()
+                    continue
+                apply(con)
+                con.execute(f"PRAGMA user_version = {int(version)};")
+            except BaseException:
+                con.rollback()
+                raise
+            con.commit()
+            current = version
+        return current
+    finally:
+        if isinstance(target, str):
+            con.close()
+
+
+@migration(1)
+def hot_path_indexes(con):
+    #fold duplicate holdings into one row before making (id, symbol) unique
+    con.execute("""
+        UPDATE userStock SET shares = (
+            SELECT SUM(shares) FROM userStock AS dup WHERE dup.id = userStock.id AND dup.symbol = userStock.symbol
+        )
+        WHERE rowid IN (SELECT MIN(rowid) FROM userStock GROUP BY id, symbol HAVING COUNT(*) > 1);
+    """)
+    con.execute("DELETE FROM userStock WHERE rowid NOT IN (SELECT MIN(rowid) FROM userStock GROUP BY id, symbol);")
+    con.execute("CREATE UNIQUE INDEX userStock_id_symbol ON userStock (id, symbol);")
+
+    con.execute("CREATE INDEX transactions_user_id ON transactions (user_id);")
+    con.execute("CREATE INDEX symbols_category ON symbols (category);")
+    con.execute("CREATE INDEX symbols_symbol ON symbols (symbol);")
+
+
+
+@migration(2)
+def data_versions(con):
+    #one counter per table, bumped by triggers so in-process caches know when to reload
+    con.execute("CREATE TABLE versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL);")
+    con.execute("INSERT INTO versions (name, version) VALUES ('symbols', 1);")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        con.execute(f"""
+            CREATE TRIGGER symbols_version_{event.lower()} AFTER {event} ON symbols
+            BEGIN
+                UPDATE versions SET version = version + 1 WHERE name = 'symbols';
+            END;
+        """)
+
+
+@migration(3)
+def iso_trade_times(con):
+    #buys were stored as mm/dd/YYYY and sells as dd/mm/YYYY, rewrite both as sortable YYYY-MM-DD HH:MM:SS
+    recorded = "time GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]*'"
+    con.execute(f"""
+        UPDATE transactions SET time = substr(time, 7, 4) || '-' || substr(time, 1, 2) || '-' || substr(time, 4, 2) || substr(time, 11)
+        WHERE shares >= 0 AND {recorded};
+    """)
+    con.execute(f"""
+        UPDATE transactions SET time = substr(time, 7, 4) || '-' || substr(time, 4, 2) || '-' || substr(time, 1, 2) || substr(time, 11)
+        WHERE shares < 0 AND {recorded};
+    """)
+    con.execute("CREATE INDEX transactions_user_id_time ON transactions (user_id, time);")
+
+
+@migration(4)
+def position_cost_basis(con):
+    #userStock becomes the materialized positions table, closed positions keep their realized P&L
+    con.execute("ALTER TABLE userStock ADD COLUMN avg_cost NUMERIC NOT NULL DEFAULT 0;")
+    con.execute("ALTER TABLE userStock ADD COLUMN realized_pnl NUMERIC NOT NULL DEFAULT 0;")
+    con.execute("ALTER TABLE userStock ADD COLUMN last_price NUMERIC;")
+
+    #replay the ledger once to seed average cost and realized P&L, positions sold down
+    #to nothing (whose rows the old routes deleted) come back as 0 share rows
+    con.executemany("""
+        INSERT INTO userStock (id, symbol, name, shares, avg_cost, realized_pnl, last_price) VALUES (?,?,?,0,?,?,?)
+        ON CONFLICT (id, symbol) DO UPDATE SET avg_cost = excluded.avg_cost, realized_pnl = excluded.realized_pnl, last_price = excluded.last_price;
+    """, replay_ledger(con))
+    con.execute("CREATE INDEX userStock_symbol ON userStock (symbol) WHERE shares > 0;")
+
+#(user id, symbol, name, average cost, realized P&L, last price) for every position in the ledger
+def replay_ledger(con):
+    positions = {}
+    for user_id, symbol, name, shares, price in con.execute("SELECT user_id, symbol, name, shares, price FROM transactions ORDER BY rowid;"):
+        _, held, avg_cost, realized, last = positions.get((user_id, symbol), (name, 0, 0.0, 0.0, None))
+        if shares >= 0:
+            if held + shares > 0:
+                avg_cost = (avg_cost * held + price * shares) / (held + shares)
+            held += shares
+        else:
+            realized += (price - avg_cost) * -shares
+            held += shares
+        positions[(user_id, symbol)] = (name, held, avg_cost, realized, price)
+    return [(user_id, symbol, name, avg_cost, realized, last) for (user_id, symbol), (name, held, avg_cost, realized, last) in positions.items()]
+
+
+@migration(5)
+def daily_closes(con):
+    #local copy of daily closing prices, filled from IEX on demand
+    con.execute("""
+        CREATE TABLE dailyPrices (
+            symbol TEXT NOT NULL,
+            date TEXT NOT NULL,
+            close NUMERIC NOT NULL,
+            PRIMARY KEY (symbol, date)
+        ) WITHOUT ROWID;
+    """)
+
+@migration(6)
+def sessions(con):
+    #server side sessions, swept by expiry
+    con.execute("""
+        CREATE TABLE sessions (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires REAL NOT NULL
+        ) WITHOUT ROWID;
+    """)
+    con.execute("CREATE INDEX sessions_expires ON sessions (expires);")
+
+@migration(7)
+def orders(con):
+    #resting limit and stop orders
+    con.execute("""
+        CREATE TABLE orders (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            name TEXT,
+            side TEXT NOT NULL CHECK (side IN ('buy', 'sell')),
+            kind TEXT NOT NULL CHECK (kind IN ('limit', 'stop')),
+            shares INTEGER NOT NULL CHECK (shares > 0),
+            trigger_price NUMERIC NOT NULL,
+            status TEXT NOT NULL DEFAULT 'open',
+            created TEXT NOT NULL,
+            closed TEXT,
+            fill_price NUMERIC,
+            note TEXT
+        );
+    """)
+
+    #the engine's startup load and the poller only look at open orders
+    con.execute("CREATE INDEX orders_open ON orders (symbol) WHERE status = 'open';")
+    con.execute("CREATE INDEX orders_user ON orders (user_id, status, id);")
+
+@migration(8)
+def transaction_versions(con):
+    #per user version of the ledger, so history pages can be revalidated without rendering them
+    for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        con.execute(f"""
+            CREATE TRIGGER transactions_version_{event.lower()} AFTER {event} ON transactions
+            BEGIN
+                INSERT INTO versions (name, version) VALUES ('transactions:' || {row}.user_id, 1)
+                ON CONFLICT (name) DO UPDATE SET version = version + 1;
+            END;
+        """)
+
+@migration(9)
+def leaderboard(con):
+    #each user's portfolio value as last computed by leaderboard.py, and a change counter
+    #bumped whenever their cash or positions change, so every process can catch up on them
+    con.execute("""
+        CREATE TABLE leaderboard (
+            user_id INTEGER PRIMARY KEY,
+            value NUMERIC NOT NULL DEFAULT 0,
+            changed INTEGER NOT NULL
+        );
+    """)
+    con.execute("CREATE INDEX leaderboard_changed ON leaderboard (changed);")
+    con.execute("CREATE INDEX leaderboard_value ON leaderboard (value DESC);")
+    con.execute("INSERT INTO leaderboard (user_id, changed) SELECT id, id FROM users;")
+
+    changes = (
+        ("users_insert", "INSERT ON users", "NEW.id"),
+        ("users_cash", "UPDATE OF cash ON users", "NEW.id"),
+        ("userStock_insert", "INSERT ON userStock", "NEW.id"),
+        ("userStock_shares", "UPDATE OF shares ON userStock", "NEW.id"),
+        ("userStock_delete", "DELETE ON userStock", "OLD.id"),
+    )
+    for name, event, user_id in changes:
+        con.execute(f"""
+            CREATE TRIGGER leaderboard_{name} AFTER {event}
+            BEGIN
+                INSERT INTO leaderboard (user_id, changed) VALUES ({user_id}, (SELECT COALESCE(MAX(changed), 0) + 1 FROM leaderboard))
+                ON CONFLICT (user_id) DO UPDATE SET changed = excluded.changed;
+            END;
+        """)
+
+
+@migration(10)
+def closed_positions(con):
+    #databases migrated to 4 before closed positions were restored get them now
+    con.executemany("""
+        INSERT INTO userStock (id, symbol, name, shares, avg_cost, realized_pnl, last_price) VALUES (?,?,?,0,?,?,?)
+        ON CONFLICT (id, symbol) DO NOTHING;
+    """, replay_ledger(con))
+
+
+#Run migrations by hand: python migrations.py [database.db]
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "database.db"
+    print(f"{path} is at schema version {migrate(path)}")
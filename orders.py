@@ -0,0 +1,203 @@
+import math
+import heapq
+import logging
+import threading
+import database
+from trades import transaction, buy_leg, sell_leg, trade_time, TradeError
+
+#Resting limit and stop orders
+#
+#Open orders live in the orders table and, per process, in two heaps per symbol keyed
+#on trigger price: one for orders that fire when the price falls to their trigger (buy
+#limits, sell stops) and one for orders that fire when it rises to it (sell limits, buy
+#stops). On every price change the engine pops orders off the top of the heaps only
+#while they are crossed, so a tick costs O(fills * log n) however many orders rest.
+#
+#Everything crossed by one tick is filled in a single BEGIN IMMEDIATE transaction. An
+#order is only filled if its row is still open, which makes cancelling cheap (the
+#order is just forgotten, its heap entry is skipped when it surfaces) and keeps several
+#worker processes from filling the same order twice. Orders whose owner can no longer
+#pay for them (or no longer holds the shares) when they trigger are rejected.
+
+log = logging.getLogger(__name__)
+
+SIDES = ("buy", "sell")
+KINDS = ("limit", "stop")
+
+#heap entries left behind by cancelled orders before the heaps are rebuilt
+COMPACT_AFTER = 10000
+
+
+#buy limits and sell stops fire when the price falls to the trigger, sell limits and buy stops when it rises to it
+def falls(side, kind):
+    return (side == "buy") == (kind == "limit")
+
+#store a new open order, returns its id
+def place(con, user_id, symbol, name, side, kind, shares, trigger):
+    if side not in SIDES or kind not in KINDS:
+        raise TradeError("Please choose a valid order type")
+    if shares <= 0 or not math.isfinite(trigger) or trigger <= 0:
+        raise TradeError("Please enter a share count and price greater than 0")
+
+    cur = con.execute(
+        "INSERT INTO orders (user_id, symbol, name, side, kind, shares, trigger_price, created) VALUES (?,?,?,?,?,?,?,?);",
+        (user_id, symbol, name, side, kind, shares, round(trigger, 2), trade_time())
+    )
+    con.commit()
+    return cur.lastrowid
+
+#cancel one of user_id's open orders, returns False if it isn't open any more
+def cancel(con, user_id, order_id):
+    cur = con.execute("UPDATE orders SET status = 'cancelled', closed = ? WHERE id = ? AND user_id = ? AND status = 'open';", (trade_time(), order_id, user_id))
+    con.commit()
+    if cur.rowcount == 0:
+        return False
+    if order_engine is not None:
+        order_engine.forget(order_id)
+    return True
+
+#user_id's open orders and their most recent closed ones
+def user_orders(con, user_id, closed=50):
+    columns = "id, symbol, name, side, kind, shares, trigger_price, status, created, closed, fill_price, note"
+    open_orders = con.execute(f"SELECT {columns} FROM orders WHERE user_id = ? AND status = 'open' ORDER BY id DESC;", (user_id,)).fetchall()
+    closed_orders = con.execute(f"SELECT {columns} FROM orders WHERE user_id = ? AND status != 'open' ORDER BY id DESC LIMIT ?;", (user_id, closed)).fetchall()
+    return open_orders, closed_orders
+
+
+class OrderEngine:
+
+    def __init__(self, path):
+        self.path = path
+        self.con = None
+        self._orders = {}
+        self._falls = {}
+        self._rises = {}
+        self._last_id = 0
+        self._dead = 0
+        self._lock = threading.RLock()
+
+    #load the open orders and start reacting to price changes in table
+    def start(self, table):
+        with self._lock:
+            if self.con is None:
+                self.con = database.connect(self.path)
+                self.load()
+                table.subscribe(self.on_prices)
+        return self
+
+    #pick up orders placed since the last load, by this process or any other
+    def load(self):
+        rows = self.con.execute("""
+            SELECT id, user_id, symbol, name, side, kind, shares, trigger_price FROM orders
+            WHERE id > ? AND status = 'open' ORDER BY id;
+        """, (self._last_id,)).fetchall()
+        for row in rows:
+            self._add(*row)
+        return len(rows)
+
+    def _add(self, order_id, user_id, symbol, name, side, kind, shares, trigger):
+        self._last_id = max(self._last_id, order_id)
+        self._orders[order_id] = (user_id, symbol, name, side, kind, shares, trigger)
+        if falls(side, kind):
+            heapq.heappush(self._falls.setdefault(symbol, []), (-trigger, order_id))
+        else:
+            heapq.heappush(self._rises.setdefault(symbol, []), (trigger, order_id))
+
+    #drop a cancelled order, its heap entry is skipped when it reaches the top
+    def forget(self, order_id):
+        with self._lock:
+            if self._orders.pop(order_id, None) is not None:
+                self._dead += 1
+                if self._dead > COMPACT_AFTER and self._dead > len(self._orders):
+                    self._compact()
+
+    #rebuild the heaps without the entries of forgotten orders
+    def _compact(self):
+        for heaps in (self._falls, self._rises):
+            for symbol in list(heaps):
+                heap = [entry for entry in heaps[symbol] if entry[1] in self._orders]
+                if heap:
+                    heapq.heapify(heap)
+                    heaps[symbol] = heap
+                else:
+                    del heaps[symbol]
+        self._dead = 0
+
+    #price table subscriber, fills every order the changed prices cross
+    def on_prices(self, changed):
+        with self._lock:
+            if self.con is None:
+                return []
+            self.load()
+            crossed = []
+            for symbol, quote in changed.items():
+                crossed += self._crossed(symbol, quote["price"])
+            return self.fill(crossed) if crossed else []
+
+    #pop every order on symbol that price triggers, as (order id, price)
+    def _crossed(self, symbol, price):
+        crossed = []
+        heap = self._falls.get(symbol)
+        while heap and -heap[0][0] >= price:
+            order_id = heapq.heappop(heap)[1]
+            if order_id in self._orders:
+                crossed.append((order_id, price))
+        heap = self._rises.get(symbol)
+        while heap and heap[0][0] <= price:
+            order_id = heapq.heappop(heap)[1]
+            if order_id in self._orders:
+                crossed.append((order_id, price))
+        return crossed
+
+    #fill crossed orders in one transaction, returns [(order id, status)]
+    def fill(self, crossed):
+        orders = [(order_id, price, self._orders.pop(order_id)) for order_id, price in crossed]
+        results = []
+        try:
+            with transaction(self.con):
+                now = trade_time()
+                for order_id, price, (user_id, symbol, name, side, kind, shares, trigger) in orders:
+                    price = round(price, 2)
+
+                    #cancelled (or filled) since it was loaded
+                    cur = self.con.execute("UPDATE orders SET status = 'filled', closed = ?, fill_price = ? WHERE id = ? AND status = 'open';", (now, price, order_id))
+                    if cur.rowcount == 0:
+                        continue
+
+                    #a leg that fails has changed nothing, so the rest of the batch carries on
+                    try:
+                        (buy_leg if side == "buy" else sell_leg)(self.con, user_id, symbol, name, shares, price)
+                        results.append((order_id, "filled"))
+                    except TradeError as error:
+                        self.con.execute("UPDATE orders SET status = 'rejected', fill_price = NULL, note = ? WHERE id = ?;", (str(error), order_id))
+                        results.append((order_id, "rejected"))
+        except Exception:
+            #nothing was written, put the orders back for the next tick
+            for order_id, price, order in orders:
+                self._add(order_id, *order)
+            raise
+
+        if results:
+            log.info("filled %d, rejected %d orders", sum(status == "filled" for _, status in results), sum(status == "rejected" for _, status in results))
+        return results
+
+    @property
+    def open_orders(self):
+        return len(self._orders)
+
+
+#Process wide engine, started by main.py
+order_engine = None
+
+def start_engine(path, table):
+    global order_engine
+    if order_engine is None:
+        order_engine = OrderEngine(path).start(table)
+    return order_engine
+
+#fill a just placed order straight away if the current price already crosses it,
+#returns that order's (status, note) afterwards
+def check(con, order_id, symbol, quote):
+    if order_engine is not None and quote is not None:
+        order_engine.on_prices({symbol: quote})
+    return con.execute("SELECT status, note FROM orders WHERE id = ?;", (order_id,)).fetchone()
@@ -0,0 +1,162 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+
+#Password hashing off the request workers
+#
+#Hashes are deliberately slow and hold the GIL while they run, so a burst of logins on
+#one worker used to stall every other route it was serving. PasswordHasher sends the
+#work to a small process pool instead (PASSWORD_WORKERS, 0 hashes inline) and refuses
+#new work once PASSWORD_QUEUE hashes are waiting, so logins queue up in front of the
+#pool rather than on the CPU.
+#
+#PASSWORD_METHOD is any werkzeug method string with its work factor, for example
+#scrypt:32768:8:1 (the default) or pbkdf2:sha256:600000. Hashes made with other
+#settings still verify and are replaced at the user's next login.
+#
+#Pool workers re-import the __main__ script, so scripts that import the app need the
+#usual `if __name__ == "__main__":` guard (or PASSWORD_WORKERS=0).
+#
+#LoginThrottle lets each username have one password check in flight at a time and
+#locks it out for PASSWORD_LOCKOUT seconds after PASSWORD_MAX_FAILURES failures.
+
+log = logging.getLogger(__name__)
+
+
+class PasswordBusy(Exception):
+    pass
+
+
+#werkzeug's defaults spelled out, so stored hashes can be compared to the settings
+DEFAULT_FACTORS = {"scrypt": "scrypt:32768:8:1", "pbkdf2": "pbkdf2:sha256:1000000", "pbkdf2:sha256": "pbkdf2:sha256:1000000"}
+
+def full_method(method):
+    return DEFAULT_FACTORS.get(method, method)
+
+#run in the pool's processes
+def _hash(password, method):
+    return generate_password_hash(password, method)
+
+def _check(password_hash, password):
+    return check_password_hash(password_hash, password)
+
+
+#Not plain fork: the app has threads (poller, quote loop) a fork would copy mid-flight.
+#Workers are forked from a clean fork server that has only this module loaded.
+def pool_context():
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+class PasswordHasher:
+
+    def __init__(self, method="scrypt", workers=2, queue=None):
+        self.method = full_method(method)
+        self.workers = workers
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(queue or max(1, workers) * 8)
+
+    def pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=pool_context())
+        return self._pool
+
+    def _run(self, function, *args):
+        if self.workers <= 0:
+            return function(*args)
+        if not self._slots.acquire(timeout=5):
+            raise PasswordBusy("Too many people are logging in right now, please try again in a moment")
+        try:
+            return self.pool().submit(function, *args).result()
+        except BrokenProcessPool:
+            #workers that can't start would keep failing, hash in this process from now on
+            log.exception("password hashing pool failed, hashing in the request threads instead")
+            self.workers = 0
+            return function(*args)
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method)
+
+    #returns (matches, needs_rehash)
+    def verify(self, password_hash, password):
+        if not self._run(_check, password_hash, password):
+            return False, False
+        return True, self.needs_rehash(password_hash)
+
+    #made with a different method or work factor than the current settings
+    def needs_rehash(self, password_hash):
+        return full_method(password_hash.split("$", 1)[0]) != self.method
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+class LoginThrottle:
+
+    def __init__(self, max_failures=5, lockout=300.0):
+        self.max_failures = max_failures
+        self.lockout = lockout
+        self._failures = {}
+        self._busy = set()
+        self._lock = threading.Lock()
+
+    #claim the right to check username's password, returns 0 or how many seconds to wait
+    def begin(self, username):
+        now = time.monotonic()
+        with self._lock:
+            if username in self._busy:
+                return 1
+            failures = [moment for moment in self._failures.get(username, ()) if now - moment < self.lockout]
+            if failures:
+                self._failures[username] = failures
+            else:
+                self._failures.pop(username, None)
+            if len(failures) >= self.max_failures:
+                return int(self.lockout - (now - failures[0])) + 1
+            self._busy.add(username)
+            return 0
+
+    #finish a check begun with begin(), a check that never ran (checked=False) isn't a failure
+    def end(self, username, ok, checked=True):
+        with self._lock:
+            self._busy.discard(username)
+            if not checked:
+                return
+            if ok:
+                self._failures.pop(username, None)
+            else:
+                self._failures.setdefault(username, []).append(time.monotonic())
+                if len(self._failures) > 100000:
+                    self._prune()
+
+    def _prune(self):
+        now = time.monotonic()
+        for username in [name for name, failures in self._failures.items() if now - failures[-1] >= self.lockout]:
+            del self._failures[username]
+
+
+#Process wide hasher and throttle
+hasher = PasswordHasher(
+    method=os.environ.get("PASSWORD_METHOD", "scrypt"),
+    workers=int(os.environ.get("PASSWORD_WORKERS", min(4, os.cpu_count() or 1))),
+    queue=int(os.environ.get("PASSWORD_QUEUE", 0)) or None
+)
+login_throttle = LoginThrottle(
+    max_failures=int(os.environ.get("PASSWORD_MAX_FAILURES", 5)),
+    lockout=float(os.environ.get("PASSWORD_LOCKOUT", 300))
+)
@@ -0,0 +1,119 @@
+import datetime
+import numpy as np
+import market
+from pricestore import price_store, bar_dates
+
+#Historical portfolio performance
+#
+#Everything is computed over a (days x symbols) grid in a handful of NumPy passes:
+#trades are scattered onto the grid and cumulatively summed into holdings, closes are
+#forward filled, and equity, daily returns, drawdown and time-weighted return follow
+#from whole-array arithmetic. Cost grows with days x symbols, not with a Python loop
+#per day per position.
+#
+#Deposits and withdrawals are not recorded anywhere, so past cash is rebuilt backwards
+#from today's cash using the trades alone.
+
+
+#daily closes for symbols since start, returns {symbol: (numpy dates, closes)}
+#the local price store is used when it has the symbol, otherwise dailyPrices topped up from the market data provider
+def daily_closes(con, symbols, start):
+    stale = (datetime.date.today() - datetime.timedelta(days=4)).isoformat()
+    closes = {}
+    for symbol in symbols:
+        if price_store.has(symbol):
+            bars = price_store.read(symbol, start)
+            closes[symbol] = (bar_dates(bars), bars["close"])
+            continue
+
+        latest = con.execute("SELECT MAX(date) FROM dailyPrices WHERE symbol = ?;", (symbol,)).fetchone()[0]
+        if latest is None or latest < stale:
+            fetched = market.provider.chart(symbol, "5y" if latest is None else "1m")
+            if fetched:
+                con.executemany("INSERT OR REPLACE INTO dailyPrices (symbol, date, close) VALUES (?,?,?);", [(symbol, date, close) for date, close in fetched])
+                con.commit()
+        rows = con.execute("SELECT date, close FROM dailyPrices WHERE symbol = ? AND date >= ? ORDER BY date;", (symbol, start)).fetchall()
+        closes[symbol] = (np.array([row[0] for row in rows], dtype="datetime64[D]"), np.array([row[1] for row in rows], dtype=float))
+    return closes
+
+#performance of user_id from their first trade to today
+def user_performance(con, user_id):
+    trades = con.execute("SELECT symbol, shares, price, time FROM transactions WHERE user_id = ? ORDER BY time;", (user_id,)).fetchall()
+    cash = con.execute("SELECT cash FROM users WHERE id = ?;", (user_id,)).fetchone()[0]
+    if not trades:
+        return None
+
+    symbols = sorted({trade[0] for trade in trades})
+    start = trades[0][3][:10]
+    return equity_curve(trades, daily_closes(con, symbols, start), cash)
+
+#equity curve and statistics for a list of (symbol, shares, price, ISO time) trades
+#closes is {symbol: (numpy dates, closes)}, cash is the cash held today
+def equity_curve(trades, closes, cash, today=None):
+    symbols = sorted({trade[0] for trade in trades})
+    column = {symbol: i for i, symbol in enumerate(symbols)}
+
+    trade_days = np.array([trade[3][:10] for trade in trades], dtype="datetime64[D]")
+    trade_columns = np.array([column[trade[0]] for trade in trades])
+    trade_shares = np.array([trade[1] for trade in trades], dtype=float)
+    trade_prices = np.array([trade[2] for trade in trades], dtype=float)
+
+    #business days from the first trade to today
+    today = np.datetime64(today or datetime.date.today(), "D")
+    first = trade_days.min()
+    days = np.arange(first, today + 1, dtype="datetime64[D]")
+    days = days[np.is_busday(days)]
+    if len(days) == 0:
+        days = np.array([first], dtype="datetime64[D]")
+
+    #trades on a weekend count from the next business day
+    rows = np.minimum(np.searchsorted(days, trade_days), len(days) - 1)
+
+    #holdings: scatter share changes onto the grid, then accumulate down the days
+    holdings = np.zeros((len(days), len(symbols)))
+    np.add.at(holdings, (rows, trade_columns), trade_shares)
+    holdings = np.cumsum(holdings, axis=0)
+
+    #closes on the grid, trade prices fill in where no close is known
+    prices = np.full((len(days), len(symbols)), np.nan)
+    for symbol, (dates, values) in closes.items():
+        if symbol not in column or len(dates) == 0:
+            continue
+        found = np.searchsorted(days, dates)
+        keep = (found < len(days)) & (days[np.minimum(found, len(days) - 1)] == dates)
+        prices[found[keep], column[symbol]] = values[keep]
+    unknown = np.isnan(prices[rows, trade_columns])
+    prices[rows[unknown], trade_columns[unknown]] = trade_prices[unknown]
+    prices = forward_fill(prices)
+
+    #cash at the end of each day: today's cash minus every trade's cash flow after that day
+    flows = np.zeros(len(days))
+    np.add.at(flows, rows, -trade_shares * trade_prices)
+    cash_curve = cash - (flows.sum() - np.cumsum(flows))
+
+    equity = cash_curve + np.nansum(holdings * prices, axis=1)
+
+    #daily returns, a day starting with nothing invested has none
+    previous = equity[:-1]
+    returns = np.divide(equity[1:] - previous, previous, out=np.zeros(len(previous)), where=previous > 0)
+
+    drawdown = equity / np.maximum.accumulate(np.maximum(equity, 1e-9)) - 1
+    twr = float(np.prod(1 + returns) - 1)
+
+    return {
+        "dates": np.datetime_as_string(days).tolist(),
+        "equity": np.round(equity, 2).tolist(),
+        "returns": np.round(returns, 6).tolist(),
+        "drawdown": np.round(drawdown, 6).tolist(),
+        "time_weighted_return": round(twr, 6),
+        "max_drawdown": round(float(drawdown.min()), 6),
+        "start_equity": round(float(equity[0]), 2),
+        "end_equity": round(float(equity[-1]), 2)
+    }
+
+#carry the last known value down each column
+def forward_fill(grid):
+    known = ~np.isnan(grid)
+    index = np.where(known, np.arange(len(grid))[:, None], 0)
+    np.maximum.accumulate(index, axis=0, out=index)
+    return grid[index, np.arange(grid.shape[1])]
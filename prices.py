@@ -0,0 +1,143 @@
+import os
+import time
+import logging
+import threading
+import database
+from iex import BATCH_SIZE
+import market
+from quotes import quote_cache
+
+#Background market data
+#
+#QuotePoller refreshes every symbol someone holds, plus anything quoted recently, in
+#bulk on a fixed schedule and publishes the results to PriceTable. Routes read prices
+#from the table, so their latency no longer depends on IEX, and the refresh cost grows
+#with the number of distinct symbols rather than with page views.
+
+log = logging.getLogger(__name__)
+
+
+class PriceTable:
+
+    def __init__(self, max_age=60.0):
+        self.max_age = max_age
+        self._prices = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    #latest quote for symbol, or None if there is none or it is older than max_age
+    def get(self, symbol):
+        entry = self._prices.get(symbol)
+        if entry is None or time.monotonic() - entry[1] > self.max_age:
+            return None
+        return entry[0]
+
+    #store fresh quotes and tell subscribers which ones changed price
+    def publish(self, quotes):
+        now = time.monotonic()
+        changed = {}
+        with self._lock:
+            for symbol, quote in quotes.items():
+                if quote is None:
+                    continue
+                previous = self._prices.get(symbol)
+                self._prices[symbol] = (quote, now)
+                if previous is None or previous[0]["price"] != quote["price"]:
+                    changed[symbol] = quote
+            subscribers = list(self._subscribers)
+
+        if changed:
+            for callback in subscribers:
+                try:
+                    callback(changed)
+                except Exception:
+                    log.exception("price subscriber failed")
+        return changed
+
+    #call callback(changed quotes) after every publish that changes a price
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers.remove(callback)
+
+
+class QuotePoller(threading.Thread):
+
+    def __init__(self, path, table, interval=15.0, recent_for=600.0, fetch=None):
+        super().__init__(name="quote-poller", daemon=True)
+        self.path = path
+        self.table = table
+        self.interval = interval
+        self.recent_for = recent_for
+        self.fetch = fetch or fetch_quotes
+        self._recent = {}
+        self._stopped = threading.Event()
+
+    #keep refreshing symbol for a while after someone quoted it
+    def track(self, symbol):
+        self._recent[symbol] = time.monotonic() + self.recent_for
+
+    #every symbol that is held by a user, has open orders or was quoted recently
+    def symbols(self, con):
+        held = [row[0] for row in con.execute("SELECT DISTINCT symbol FROM userStock WHERE shares > 0 UNION SELECT DISTINCT symbol FROM orders WHERE status = 'open';")]
+        now = time.monotonic()
+        for symbol, until in list(self._recent.items()):
+            if until < now:
+                self._recent.pop(symbol, None)
+        return list(dict.fromkeys(held + list(self._recent)))
+
+    #refresh every tracked symbol once
+    def poll(self, con):
+        symbols = self.symbols(con)
+        if symbols:
+            self.table.publish(self.fetch(symbols))
+        return len(symbols)
+
+    def run(self):
+        con = database.connect(self.path)
+        try:
+            while not self._stopped.is_set():
+                started = time.monotonic()
+                try:
+                    self.poll(con)
+                except Exception:
+                    log.exception("quote refresh failed")
+                self._stopped.wait(max(0.0, self.interval - (time.monotonic() - started)))
+        finally:
+            con.close()
+
+    def stop(self):
+        self._stopped.set()
+
+
+#fetch fresh quotes in batches straight from the market data provider, warming the quote cache on the way
+def fetch_quotes(symbols):
+    results = {}
+    for start in range(0, len(symbols), BATCH_SIZE):
+        chunk = symbols[start:start + BATCH_SIZE]
+        results.update(market.provider.quotes(chunk) or {})
+    for symbol, quote in results.items():
+        if quote is not None:
+            quote_cache.put(symbol, quote)
+    return results
+
+
+#Process wide price table and poller, started by main.py
+POLL_INTERVAL = float(os.environ.get("QUOTE_POLL_INTERVAL", 15))
+price_table = PriceTable(max_age=max(3 * POLL_INTERVAL, 60.0))
+quote_poller = None
+
+def start_poller(path):
+    global quote_poller
+    if quote_poller is None and POLL_INTERVAL > 0:
+        quote_poller = QuotePoller(path, price_table, interval=POLL_INTERVAL)
+        quote_poller.start()
+    return quote_poller
+
+#keep refreshing symbol once the poller is running
+def track(symbol):
+    if quote_poller is not None:
+        quote_poller.track(symbol)
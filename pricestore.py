@@ -0,0 +1,141 @@
+import os
+import csv
+import sys
+import sqlite3
+import threading
+import numpy as np
+
+#Local OHLC price history
+#
+#Every symbol gets one .npy file holding a date sorted structured array of daily
+#date/open/high/low/close/volume rows. Files are opened with mmap_mode="r", so a range
+#read is a binary search on the date column plus a slice of the mapped file: no copy,
+#no parsing and no network. Only symbols listed in the symbols table are accepted.
+
+BAR = np.dtype([
+    ("date", "<i4"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<i8")
+])
+
+
+class PriceStore:
+
+    def __init__(self, path):
+        self.path = path
+        self._maps = {}
+        self._lock = threading.Lock()
+
+    def file(self, symbol):
+        return os.path.join(self.path, f"{symbol.upper()}.npy")
+
+    def has(self, symbol):
+        return os.path.exists(self.file(symbol))
+
+    #memory-mapped bars for symbol, reopened if the file was replaced since
+    def bars(self, symbol):
+        path = self.file(symbol)
+        try:
+            stamp = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            cached = self._maps.get(symbol)
+            if cached is None or cached[0] != stamp:
+                cached = self._maps[symbol] = (stamp, np.load(path, mmap_mode="r"))
+        return cached[1]
+
+    #bars for symbol between start and end (inclusive YYYY-MM-DD strings or dates), as a view of the file
+    def read(self, symbol, start=None, end=None):
+        bars = self.bars(symbol)
+        if bars is None:
+            return np.empty(0, dtype=BAR)
+        dates = bars["date"]
+        lo = np.searchsorted(dates, day_number(start)) if start else 0
+        hi = np.searchsorted(dates, day_number(end), side="right") if end else len(bars)
+        return bars[lo:hi]
+
+    #merge rows of (date, open, high, low, close, volume) into symbol's file, newer rows win
+    def write(self, symbol, rows):
+        new = np.array([(day_number(row[0]),) + tuple(row[1:]) for row in rows], dtype=BAR)
+        old = self.bars(symbol)
+        if old is not None:
+            new = np.concatenate([new, np.array(old)])
+
+        #keep the first (newest) row for each date, sorted by date
+        _, first = np.unique(new["date"], return_index=True)
+        merged = new[first]
+
+        os.makedirs(self.path, exist_ok=True)
+        temp = self.file(symbol) + ".tmp"
+        with open(temp, "wb") as f:
+            np.save(f, merged)
+        os.replace(temp, self.file(symbol))
+        return len(merged)
+
+    #bulk load CSV files with date,open,high,low,close,volume columns
+    #the symbol comes from a symbol column or else from the file name (AAPL.csv)
+    #returns {symbol: bars stored}, symbols missing from the symbols table are skipped
+    def ingest(self, con, paths):
+        rows = {}
+        for path in paths:
+            default = os.path.splitext(os.path.basename(path))[0].upper()
+            with open(path, newline="") as f:
+                for record in csv.DictReader(f):
+                    record = {key.strip().lower(): value for key, value in record.items() if key}
+                    symbol = (record.get("symbol") or default).strip().upper()
+                    rows.setdefault(symbol, []).append((
+                        record["date"][:10],
+                        float(record["open"]),
+                        float(record["high"]),
+                        float(record["low"]),
+                        float(record["close"]),
+                        int(float(record.get("volume") or 0))
+                    ))
+
+        listed = listed_symbols(con, rows)
+        stored = {}
+        for symbol, bars in rows.items():
+            if symbol in listed:
+                stored[symbol] = self.write(symbol, bars)
+        return stored
+
+
+#symbols out of `symbols` that are in the symbols table
+def listed_symbols(con, symbols):
+    listed = set()
+    for symbol in symbols:
+        if con.execute("SELECT 1 FROM symbols WHERE symbol = ? LIMIT 1;", (symbol,)).fetchone():
+            listed.add(symbol)
+    return listed
+
+#days since 1970-01-01 for a YYYY-MM-DD string or date
+def day_number(value):
+    return int(np.datetime64(str(value)[:10], "D").astype(np.int64))
+
+#the date column of bars as numpy dates
+def bar_dates(bars):
+    return bars["date"].astype("datetime64[D]")
+
+
+#Process wide store, kept next to the database unless PRICE_STORE says otherwise
+price_store = PriceStore(os.environ.get("PRICE_STORE", "prices"))
+
+
+#Command line: python pricestore.py ingest file.csv [...] | python pricestore.py show SYMBOL [start] [end]
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "ingest":
+        con = sqlite3.connect(os.environ.get("DATABASE", "database.db"))
+        for symbol, count in sorted(price_store.ingest(con, sys.argv[2:]).items()):
+            print(f"{symbol}: {count} bars")
+        con.close()
+    elif len(sys.argv) >= 3 and sys.argv[1] == "show":
+        bars = price_store.read(sys.argv[2], *sys.argv[3:5])
+        for day, bar in zip(bar_dates(bars), bars):
+            print(day, bar["open"], bar["high"], bar["low"], bar["close"], bar["volume"])
+    else:
+        print("usage: python pricestore.py ingest file.csv [...] | show SYMBOL [start] [end]")
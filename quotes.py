@@ -0,0 +1,108 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+#Shared in-process cache for stock quotes
+#
+#Entries live for `ttl` seconds and the least recently used entry is evicted once
+#`maxsize` is reached. Concurrent misses for the same symbol are coalesced so only
+#one thread calls the upstream loader while the rest wait for its result.
+class QuoteCache:
+
+    def __init__(self, ttl=15.0, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    #return the cached value for key, loading it with load(key) when missing or expired
+    def get(self, key, load):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                #expired, drop it and fall through to a reload
+                del self._entries[key]
+                self.stale += 1
+            else:
+                self.misses += 1
+
+            #if another thread is already loading this key, wait for it
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            return flight.value
+
+        value = None
+        try:
+            value = load(key)
+        finally:
+            flight.value = value
+            with self._lock:
+                #failed lookups are not cached so the next caller retries upstream
+                if value is not None:
+                    self._store(key, value)
+                del self._inflight[key]
+            flight.done.set()
+        return value
+
+    #insert a value loaded elsewhere (e.g. a batch fetch)
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    #return the cached value for key without loading it, or None
+    def peek(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                return entry[0]
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "size": len(self._entries),
+                "ttl": self.ttl,
+                "maxsize": self.maxsize
+            }
+
+    def _store(self, key, value):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+class _Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+
+#Process wide cache used by views.lookup(), tunable through the environment
+quote_cache = QuoteCache(
+    ttl=float(os.environ.get("QUOTE_TTL", 15)),
+    maxsize=int(os.environ.get("QUOTE_CACHE_SIZE", 1024))
+)
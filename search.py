@@ -0,0 +1,70 @@
+import threading
+from bisect import bisect_left
+from catalog import catalog
+
+#In-memory prefix index over the symbols table
+#
+#Symbols and the words of company names are kept in two sorted lists, so a prefix
+#query is a binary search followed by a short walk over the matching run. The index
+#is rebuilt from the catalog whenever the catalog reloads.
+
+
+class SymbolIndex:
+
+    def __init__(self):
+        self.version = None
+        self.names = {}
+        self._symbol_keys = []
+        self._word_keys = []
+        self._lock = threading.Lock()
+
+    #rebuild from the catalog if symbols changed since the last build
+    def refresh(self, con):
+        catalog.refresh(con)
+        if catalog.version == self.version:
+            return self
+
+        with self._lock:
+            if catalog.version != self.version:
+                names = {}
+                for rows in catalog.by_category.values():
+                    for category, name, symbol in rows:
+                        if symbol:
+                            names.setdefault(symbol.upper(), name or "")
+
+                words = set()
+                for symbol, name in names.items():
+                    for word in name.lower().split():
+                        words.add((word, symbol))
+
+                self._symbol_keys = sorted((symbol.lower(), symbol) for symbol in names)
+                self._word_keys = sorted(words)
+                self.names = names
+                self.version = catalog.version
+        return self
+
+    #whether symbol is a listed stock
+    def has(self, symbol):
+        return symbol.upper() in self.names
+
+    #up to limit {symbol, name} matches for q, symbol matches first then company name matches
+    def search(self, q, limit=10):
+        q = q.strip().lower()
+        if not q:
+            return []
+
+        found = []
+        seen = set()
+        for keys in (self._symbol_keys, self._word_keys):
+            i = bisect_left(keys, (q,))
+            while i < len(keys) and len(found) < limit and keys[i][0].startswith(q):
+                symbol = keys[i][1]
+                if symbol not in seen:
+                    seen.add(symbol)
+                    found.append({"symbol": symbol, "name": self.names[symbol]})
+                i += 1
+        return found
+
+
+#Process wide index used by the autocomplete endpoint and buy()
+symbol_index = SymbolIndex()
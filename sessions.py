@@ -0,0 +1,228 @@
+import os
+import time
+import secrets
+import threading
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from werkzeug.datastructures import CallbackDict
+import database
+
+#Server side sessions shared by every worker
+#
+#The cookie only carries a random session id; the data lives in a store every worker
+#and node can reach, so requests can land anywhere behind a load balancer and sessions
+#survive restarts. Picked with SESSION_BACKEND:
+#
+#    sqlite  the sessions table in the app database (the default), expired rows are
+#            swept every SESSION_SWEEP seconds
+#    redis   a Redis server at SESSION_REDIS_URL (needs `pip install redis`), keys
+#            expire on their own
+#    local   the Redis code path against an in-process stand-in, for single process
+#            runs and trying the Redis backend without a server
+#
+#Sessions expire after SESSION_LIFETIME seconds without a request. Clearing a session
+#(login and logout both do) gives it a new id.
+
+
+class ServerSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, expires=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.replaced = None
+        self.modified = False
+
+    #drop the data and the id, so a cookie seen before login is useless after it
+    def clear(self):
+        super().clear()
+        if self.sid is not None:
+            self.replaced = self.sid
+            self.sid = None
+
+
+class ServerSessionInterface(SessionInterface):
+
+    #lifetime is the idle timeout in seconds, expiry is pushed back at most once per `refresh` seconds
+    def __init__(self, store, lifetime=7 * 86400.0, refresh=None):
+        self.store = store
+        self.lifetime = lifetime
+        self.refresh = lifetime / 10 if refresh is None else refresh
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            found = self.store.load(sid)
+            if found is not None:
+                try:
+                    return ServerSession(session_json_serializer.loads(found[0]), sid, found[1])
+                except ValueError:
+                    pass
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if session.replaced is not None:
+            self.store.delete(session.replaced)
+            session.replaced = None
+
+        if not session:
+            if session.modified:
+                if session.sid is not None:
+                    self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app), httponly=self.get_cookie_httponly(app))
+            return
+
+        now = time.time()
+        expires = now + self.lifetime
+        new = session.sid is None
+        if new:
+            session.sid = secrets.token_urlsafe(32)
+        if new or session.modified:
+            self.store.save(session.sid, session_json_serializer.dumps(dict(session)), expires)
+        elif session.expires is None or session.expires - now < self.lifetime - self.refresh:
+            self.store.touch(session.sid, expires)
+
+        if new or session.permanent:
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session), domain=domain, path=path,
+                                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app), httponly=self.get_cookie_httponly(app))
+
+
+#Sessions in the sessions table, on connections borrowed from the database pool
+class SQLiteSessionStore:
+
+    def __init__(self, path, sweep_every=300.0):
+        self.path = path
+        self.sweep_every = sweep_every
+        self._swept = time.time()
+        self._sweeping = threading.Lock()
+
+    #(data, expires) for a live session, or None
+    def load(self, sid):
+        with database.borrowed(self.path) as con:
+            return con.execute("SELECT data, expires FROM sessions WHERE id = ? AND expires > ?;", (sid, time.time())).fetchone()
+
+    def save(self, sid, data, expires):
+        with database.borrowed(self.path) as con, con:
+            con.execute("""
+                INSERT INTO sessions (id, data, expires) VALUES (?,?,?)
+                ON CONFLICT (id) DO UPDATE SET data = excluded.data, expires = excluded.expires;
+            """, (sid, data, expires))
+        self.maybe_sweep()
+
+    def touch(self, sid, expires):
+        with database.borrowed(self.path) as con, con:
+            con.execute("UPDATE sessions SET expires = ? WHERE id = ?;", (expires, sid))
+
+    def delete(self, sid):
+        with database.borrowed(self.path) as con, con:
+            con.execute("DELETE FROM sessions WHERE id = ?;", (sid,))
+
+    #delete every expired session, returns how many went
+    def sweep(self):
+        with database.borrowed(self.path) as con, con:
+            return con.execute("DELETE FROM sessions WHERE expires <= ?;", (time.time(),)).rowcount
+
+    #sweep if the last sweep was long enough ago and nobody else is sweeping
+    def maybe_sweep(self):
+        if time.time() - self._swept < self.sweep_every or not self._sweeping.acquire(blocking=False):
+            return
+        try:
+            self._swept = time.time()
+            self.sweep()
+        finally:
+            self._sweeping.release()
+
+
+#Sessions in Redis, or anything with the same get/set(ex=)/expire/delete methods
+class RedisSessionStore:
+
+    def __init__(self, client, prefix="session:"):
+        self.client = client
+        self.prefix = prefix
+
+    #the expiry time rides along in the value so load() needs one round trip
+    def load(self, sid):
+        value = self.client.get(self.prefix + sid)
+        if value is None:
+            return None
+        if isinstance(value, bytes):
+            value = value.decode()
+        expires, _, data = value.partition("|")
+        return data, float(expires)
+
+    def save(self, sid, data, expires):
+        self.client.set(self.prefix + sid, f"{expires:.3f}|{data}", ex=seconds_left(expires))
+
+    def touch(self, sid, expires):
+        found = self.load(sid)
+        if found is not None:
+            self.save(sid, found[0], expires)
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+    def sweep(self):
+        return 0
+
+
+#In-process stand-in for the few Redis commands RedisSessionStore uses
+class LocalRedis:
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.time():
+                del self._data[key]
+                return None
+            return entry[0].encode()
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = (value, None if ex is None else time.time() + ex)
+        return True
+
+    def expire(self, key, seconds):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False
+            self._data[key] = (entry[0], time.time() + seconds)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+
+def seconds_left(expires):
+    return max(1, int(expires - time.time() + 0.5))
+
+#session interface for SESSION_BACKEND, sqlite sessions go in the database at path
+def make_interface(path):
+    kind = os.environ.get("SESSION_BACKEND", "sqlite").lower()
+    lifetime = float(os.environ.get("SESSION_LIFETIME", 7 * 86400))
+    if kind == "sqlite":
+        store = SQLiteSessionStore(path, sweep_every=float(os.environ.get("SESSION_SWEEP", 300)))
+    elif kind == "redis":
+        import redis
+        store = RedisSessionStore(redis.Redis.from_url(os.environ.get("SESSION_REDIS_URL", "redis://localhost:6379/0")))
+    elif kind == "local":
+        store = RedisSessionStore(LocalRedis())
+    else:
+        raise RuntimeError(f"Unknown SESSION_BACKEND {kind!r}")
+    return ServerSessionInterface(store, lifetime)
@@ -0,0 +1,27 @@
+//Fill the symbol-suggestions datalist from /api/search as the user types
+document.querySelectorAll("input[list='symbol-suggestions']").forEach(function (input) {
+    var list = document.getElementById("symbol-suggestions");
+    var pending = null;
+
+    input.addEventListener("input", function () {
+        clearTimeout(pending);
+        pending = setTimeout(function () {
+            var q = input.value.trim();
+            if (!q) {
+                list.innerHTML = "";
+                return;
+            }
+            fetch("/api/search?q=" + encodeURIComponent(q))
+                .then(function (response) { return response.json(); })
+                .then(function (matches) {
+                    list.innerHTML = "";
+                    matches.forEach(function (match) {
+                        var option = document.createElement("option");
+                        option.value = match.symbol;
+                        option.textContent = match.name;
+                        list.appendChild(option);
+                    });
+                });
+        }, 100);
+    });
+});
@@ -0,0 +1,104 @@
+import json
+import queue
+import threading
+
+#Live portfolio valuation over Server-Sent Events
+#
+#PriceFanout subscribes to the price table once and copies every price change into a
+#small queue per connected client, so one upstream refresh serves every open account
+#page. Each stream blocks a worker for as long as it stays open, so run the app on a
+#threaded or gevent server (e.g. gunicorn -k gevent or --threads) when using it.
+
+
+class PriceFanout:
+
+    def __init__(self, table, backlog=16):
+        self.table = table
+        self.backlog = backlog
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._subscribed = False
+
+    #register a client, returns the queue its price changes arrive on
+    def connect(self):
+        client = queue.Queue(maxsize=self.backlog)
+        with self._lock:
+            self._clients.add(client)
+            if not self._subscribed:
+                self.table.subscribe(self.publish)
+                self._subscribed = True
+        return client
+
+    def disconnect(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    #called by the price table with {symbol: quote} for every change
+    def publish(self, changed):
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            try:
+                client.put_nowait(changed)
+            except queue.Full:
+                #a slow client only ever misses old updates, never the newest one
+                try:
+                    client.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    client.put_nowait(changed)
+                except queue.Full:
+                    pass
+
+    @property
+    def clients(self):
+        return len(self._clients)
+
+
+#format one SSE message
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+#yield SSE messages with position value deltas for one user
+#load_positions() returns (cash, {symbol: shares}) for the user
+def portfolio_events(fanout, load_positions, keepalive=15.0):
+    client = fanout.connect()
+    try:
+        #ask browsers to reconnect quickly if the stream drops
+        yield "retry: 3000\n\n"
+
+        while True:
+            try:
+                changed = client.get(timeout=keepalive)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+
+            #fold in anything else already waiting
+            changed = dict(changed)
+            while True:
+                try:
+                    changed.update(client.get_nowait())
+                except queue.Empty:
+                    break
+
+            cash, positions = load_positions()
+            deltas = {}
+            for symbol, quote in changed.items():
+                if symbol in positions:
+                    deltas[symbol] = {"price": round(quote["price"], 2), "value": round(quote["price"] * positions[symbol], 2)}
+            if not deltas:
+                continue
+
+            #grand total, left out if a holding has no current price
+            total = cash
+            for symbol, shares in positions.items():
+                quote = changed.get(symbol) or fanout.table.get(symbol)
+                if quote is None:
+                    total = None
+                    break
+                total += quote["price"] * shares
+            yield sse("valuation", {"positions": deltas, "total": None if total is None else round(total, 2)})
+    finally:
+        fanout.disconnect(client)
@@ -0,0 +1,123 @@
+from contextlib import contextmanager
+from datetime import datetime
+
+#Trade execution engine
+#
+#Each order runs as one BEGIN IMMEDIATE transaction: the write lock is taken up front,
+#cash and shares are checked by the UPDATE itself (WHERE cash >= ? / shares >= ?), and
+#the whole order is committed once. Concurrent workers therefore can't overdraw an
+#account or sell the same shares twice.
+
+
+class TradeError(Exception):
+    pass
+
+
+#transactions.time is stored as sortable ISO-8601 text
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+#current time as stored in transactions.time
+def trade_time():
+    return datetime.now().strftime(TIME_FORMAT)
+
+#run the body in a single write transaction, committing on success and rolling back on error
+@contextmanager
+def transaction(con):
+    con.execute("BEGIN IMMEDIATE;")
+    try:
+        yield con
+    except BaseException:
+        con.rollback()
+        raise
+    con.commit()
+
+#buy shares of symbol at price for user_id, returns the total cost
+def execute_buy(con, user_id, symbol, name, shares, price):
+    total = price * shares
+
+    with transaction(con):
+        buy_leg(con, user_id, symbol, name, shares, price)
+
+    return total
+
+#sell shares of symbol at price for user_id, returns the total proceeds
+def execute_sell(con, user_id, symbol, name, shares, price):
+    total = price * shares
+
+    with transaction(con):
+        sell_leg(con, user_id, symbol, name, shares, price)
+
+    return total
+
+#run a basket of (side, symbol, name, shares, price) legs as one transaction, returns each leg's total in order
+#the basket is checked against cash and holdings as a whole first, and sells run before buys so their proceeds can pay for them
+def execute_basket(con, user_id, legs):
+    totals = [round(price * shares, 2) for side, symbol, name, shares, price in legs]
+
+    with transaction(con):
+        check_basket(con, user_id, legs)
+        for i in sorted(range(len(legs)), key = lambda i: legs[i][0] != "sell"):
+            side, symbol, name, shares, price = legs[i]
+            (sell_leg if side == "sell" else buy_leg)(con, user_id, symbol, name, shares, price)
+
+    return totals
+
+#raise TradeError unless user_id can afford every buy and holds every share sold in legs
+def check_basket(con, user_id, legs):
+    selling = {}
+    cash_needed = 0.0
+    for side, symbol, name, shares, price in legs:
+        if side == "sell":
+            selling[symbol] = selling.get(symbol, 0) + shares
+            cash_needed -= price * shares
+        else:
+            cash_needed += price * shares
+
+    for symbol, shares in selling.items():
+        row = con.execute("SELECT shares FROM userStock WHERE id = ? AND symbol = ?;", (user_id, symbol)).fetchone()
+        held = row[0] if row else 0
+        if held < shares:
+            raise TradeError(f"You only own {held} shares of {symbol}")
+
+    cash = con.execute("SELECT cash FROM users WHERE id = ?;", (user_id,)).fetchone()[0]
+    if cash_needed > cash:
+        raise TradeError(f"You do not have enough money: the orders need ${cash_needed:,.2f}, you have ${cash:,.2f}")
+
+#buy leg, must run inside transaction()
+def buy_leg(con, user_id, symbol, name, shares, price):
+    total = price * shares
+
+    #take the cash only if the user still has enough
+    cur = con.execute("UPDATE users SET cash = cash - ? WHERE id = ? AND cash >= ?;", (total, user_id, total))
+    if cur.rowcount == 0:
+        raise TradeError("You do not have enough money")
+
+    #add to the position, folding the price into its average cost
+    con.execute("""
+        INSERT INTO userStock (id,symbol,name,shares,avg_cost,last_price) VALUES(?,?,?,?,?,?)
+        ON CONFLICT (id, symbol) DO UPDATE SET
+            avg_cost = (avg_cost * shares + excluded.avg_cost * excluded.shares) / (shares + excluded.shares),
+            shares = shares + excluded.shares,
+            last_price = excluded.last_price;
+    """, (user_id, symbol, name, shares, price, price))
+
+    date_time = trade_time()
+    con.execute("INSERT INTO transactions (user_id,symbol,name,shares,price,time) VALUES(?,?,?,?,?,?);", (user_id, symbol, name, shares, price, date_time))
+
+#sell leg, must run inside transaction()
+def sell_leg(con, user_id, symbol, name, shares, price):
+    total = price * shares
+
+    #take the shares only if the user still owns enough of them
+    #the position is kept at 0 shares once closed so its realized P&L survives
+    cur = con.execute("""
+        UPDATE userStock SET shares = shares - ?, realized_pnl = realized_pnl + (? - avg_cost) * ?, last_price = ?
+        WHERE id = ? AND symbol = ? AND shares >= ?;
+    """, (shares, price, shares, price, user_id, symbol, shares))
+    if cur.rowcount == 0:
+        raise TradeError("You don't own that many shares of this company")
+
+    con.execute("UPDATE users SET cash = cash + ? WHERE id = ?;", (total, user_id))
+
+    date_time = trade_time()
+    con.execute("INSERT INTO transactions (user_id, symbol, name, shares, price, time) VALUES (?,?,?,?,?,?);", (user_id, symbol, name, -1 * shares, price, date_time))
@@ -1,15 +1,33 @@
 import os
-import sqlite3
-import requests
-import urllib.parse
+import math
 from functools import wraps
 from datetime import datetime
-from flask import Blueprint, render_template, flash, redirect, session, request
-from werkzeug.security import check_password_hash, generate_password_hash
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, render_template, flash, redirect, session, request, jsonify, Response, stream_with_context
+from database import get_db
+from catalog import catalog
+from search import symbol_index
+import ledger
+from performance import user_performance
+from pricestore import price_store, bar_dates
+from quotes import quote_cache
+from prices import price_table, track
+from stream import PriceFanout, portfolio_events
+from iex import BATCH_SIZE
+import market
+from trades import execute_buy, execute_sell, execute_basket, TradeError, TIME_FORMAT
+import orders
+import leaderboard
+from passwords import hasher, login_throttle, PasswordBusy
+from httpcache import conditional
+from catalog import data_version
 
 #Configure blueprint
 views = Blueprint("views", __name__)
 
+#one shared subscription to price changes for every live account page
+fanout = PriceFanout(price_table)
+
 #Login_required decorator
 def login_required(f):
     @wraps(f)
@@ -19,27 +37,64 @@ def login_required(f):
         return f(*args, **kwargs)
     return wrap
 
-#lookup stock info
+#lookup stock info, served from the shared quote cache when fresh
 def lookup(symbol):
-    # Contact API
-    try:
-        api_key = os.environ.get("API_KEY")
-        url = f"https://cloud.iexapis.com/stable/stock/{urllib.parse.quote_plus(symbol)}/quote?token={api_key}"
-        response = requests.get(url)
-        response.raise_for_status()
-    except requests.RequestException:
-        return None
-
-    # Parse response
-    try:
-        quote = response.json()
-        return {
-            "name": quote["companyName"],
-            "price": float(quote["latestPrice"]),
-            "symbol": quote["symbol"]
-        }
-    except (KeyError, TypeError, ValueError):
-        return None
+    return quote_cache.get(symbol, market.provider.quote)
+
+#threads used when the batch endpoint is unavailable
+lookup_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("QUOTE_WORKERS", 8)))
+
+#lookup many stocks at once, returns {symbol: info or None}
+def lookup_many(symbols):
+    results = {}
+    missing = []
+
+    #serve whatever is already cached
+    for symbol in dict.fromkeys(symbols):
+        cached = quote_cache.peek(symbol)
+        if cached is not None:
+            results[symbol] = cached
+        else:
+            missing.append(symbol)
+
+    #one upstream call per chunk of missing symbols
+    for start in range(0, len(missing), BATCH_SIZE):
+        chunk = missing[start:start + BATCH_SIZE]
+        batch = market.provider.quotes(chunk)
+
+        #if the batch call failed, quote the chunk concurrently instead
+        if batch is None:
+            batch = dict(zip(chunk, lookup_pool.map(lookup, chunk)))
+
+        for symbol in chunk:
+            results[symbol] = batch.get(symbol)
+            if results[symbol] is not None:
+                quote_cache.put(symbol, results[symbol])
+
+    return results
+
+#current quote, read from the background price table when it has one
+def current_quote(symbol):
+    quote = price_table.get(symbol)
+    if quote is None:
+        quote = lookup(symbol)
+        track(symbol)
+    return quote
+
+#current quotes for many symbols, only the ones the price table lacks go upstream
+def current_quotes(symbols):
+    results = {}
+    missing = []
+    for symbol in symbols:
+        results[symbol] = price_table.get(symbol)
+        if results[symbol] is None:
+            missing.append(symbol)
+
+    if missing:
+        results.update(lookup_many(missing))
+        for symbol in missing:
+            track(symbol)
+    return results
 
 #change float value into dollar-cent form
 def usd(value):
@@ -50,7 +105,7 @@ def usd(value):
 #Register users
 @views.route("/register", methods = ["GET", "POST"])
 def register():
-    con = sqlite3.connect("database.db")
+    con = get_db()
     db = con.cursor()
     
     #if method is post
@@ -102,13 +157,16 @@ def register():
             flash("Username already exists", category = "error")
             return redirect("/register")
         else:
-            #Hash the user's password
-            password_hash = generate_password_hash(password)
+            #Hash the user's password (in the hashing pool)
+            try:
+                password_hash = hasher.hash(password)
+            except PasswordBusy as error:
+                flash(str(error), category = "error")
+                return redirect("/register")
 
             #Insert into users the username, hashed password, and starting cash
             db.execute("INSERT INTO users (username, hash, cash) VALUES(?,?,?)", (username, password_hash, startMoney))
         con.commit()
-        con.close()
         #return user to login page
         flash("Successfully registered!", category="success")
         return redirect('/login')
@@ -121,7 +179,7 @@ def register():
 @views.route("/login", methods = ["GET","POST"])
 def login():
 
-    con = sqlite3.connect("database.db")
+    con = get_db()
     db = con.cursor()
 
     #Forget prior user_id
@@ -151,18 +209,40 @@ def login():
             flash("You entered the wrong username", category="error")
             return redirect("/login")
 
+        #one check at a time per username, and a lockout after repeated failures
+        wait = login_throttle.begin(username)
+        if wait:
+            flash(f"Too many login attempts, please try again in {wait} seconds", category="error")
+            return redirect("/login")
+
         #if password doesn't match hashed password
-        if not check_password_hash(rows[0][2], password):
+        matches = checked = False
+        try:
+            matches, rehash = hasher.verify(rows[0][2], password)
+            checked = True
+        except PasswordBusy as error:
+            flash(str(error), category="error")
+            return redirect("/login")
+        finally:
+            login_throttle.end(username, matches, checked)
+
+        if not matches:
             flash("You entered the wrong password", category="error")
             return redirect("/login")
 
+        #hashed with older settings, store it again with the current ones
+        if rehash:
+            try:
+                db.execute("UPDATE users SET hash = ? WHERE id = ?;", (hasher.hash(password), rows[0][0]))
+            except PasswordBusy:
+                pass
+
         #remember user id in session
         session["user_id"] = rows[0][0]
         
         #remember user username in session
         session['user'] = rows[0][1]
         con.commit()
-        con.close()
 
         #redirect to homepage
         flash("Logged in!", category="success")
@@ -172,34 +252,38 @@ def login():
     else:
         return render_template("login.html")
 
+#the home page and category pages only change with the symbols table (and who is logged in)
+def catalog_version():
+    return session['user_id'], data_version(get_db(), "symbols")
+
 @views.route("/", methods = ["GET", "POST"])
 @login_required
+@conditional(catalog_version)
 def index():
-    con = sqlite3.connect("database.db")
-    db = con.cursor()
+    con = get_db()
     
-    #all the categories
-    db.execute("SELECT DISTINCT category FROM symbols ORDER BY category")
-    tags = db.fetchall()
+    #all the categories, cached in memory until symbols changes
+    shelf = catalog.refresh(con)
+    tags = shelf.categories
     length = len(tags)
 
+    #getting list of stocks based on category, later pages are GET links
+    category = request.form.get("category") or request.args.get("category")
+    if category:
+        page = request.args.get("page", 1, type = int)
+        results, page, pages = shelf.page(category, page)
+        results_length = len(results)
+
+        return render_template("home.html", selection = True, tags = tags, results = results, results_length = results_length, length = length, category = category, page = page, pages = pages)
+
     #if method is post
     if request.method=="POST":
-        
-        #getting list of stocks based on category
-        if request.form.get("category"):
-            category = request.form.get("category")
-            db.execute("SELECT * FROM symbols WHERE category=?;", (category,))
-            results = db.fetchall()
-            results_length = len(results)
-
-            return render_template("home.html", selection = True, tags = tags, results = results, results_length = results_length, length = length, category = category)
 
         #Quoting price of stock
-        elif request.form.get("symbol"):
+        if request.form.get("symbol"):
             symbol = request.form.get("symbol").strip().upper()
 
-            values = lookup(symbol)
+            values = current_quote(symbol)
 
             if values is None:
                 flash("Please enter a valid stock symbol", category = "error")
@@ -216,9 +300,6 @@ def index():
 
     #if method is get
     else:
-        db.execute("SELECT DISTINCT category FROM symbols ORDER BY category")
-        tags = db.fetchall()
-        length = len(tags)
         return render_template("home.html", quoted = False, selection = False, tags = tags, length = length)
 
 
@@ -226,34 +307,33 @@ def index():
 @login_required
 def account():
     user_id = session['user_id']
-    con = sqlite3.connect("database.db")
+    con = get_db()
     db = con.cursor()
 
-    db.execute("SELECT symbol,name,shares FROM userStock WHERE id=?;", (user_id,))
-    values = db.fetchall()
-
-    #check if any of the stocks have 0 shares
-    for index in range(len(values)):
-        if values[index][2] == 0:
-            #if so, remove that line
-            symbol = values[index][0]
-            db.execute("DELETE FROM userStock WHERE symbol=? AND id = ?;", (symbol, user_id))
-            con.commit()
-
-    db.execute("SELECT symbol,name,shares FROM userStock WHERE id=?;", (user_id,))
+    #open positions, kept up to date by the trade engine
+    db.execute("SELECT symbol,name,shares,avg_cost,last_price FROM userStock WHERE id=? AND shares > 0;", (user_id,))
     values = db.fetchall()
 
-    #GET current stock price for every symbol
+    #GET current stock price for every symbol, at most one batch goes upstream
+    quotes = current_quotes([row[0] for row in values])
     table = {}
 
     for i in range(len(values)):
         symbol = values[i][0]
-        price = lookup(symbol)['price']
+
+        #fall back to the last traded price if there is no quote right now, or the average cost for
+        #positions no trade has priced yet (last_price is only backfilled from the ledger)
+        if quotes[symbol]:
+            price = quotes[symbol]['price']
+        elif values[i][4] is not None:
+            price = values[i][4]
+        else:
+            price = values[i][3]
         table[symbol] = round(price,2)
 
-    #Current cash of user
-    db.execute("SELECT cash FROM users WHERE id = ?", (user_id,))
-    cash = db.fetchall()[0][0]
+    #Current cash of user and realized P&L over all positions, closed ones included
+    db.execute("SELECT cash, (SELECT TOTAL(realized_pnl) FROM userStock WHERE id = users.id) FROM users WHERE id = ?", (user_id,))
+    cash, realized = db.fetchone()
 
     #Total cash
     total_cash = 0
@@ -263,14 +343,67 @@ def account():
         price = table[symbol]
         total_cash = total_cash + (shares*price)
     
-    return render_template("account.html", total_cash = total_cash, cash = cash, values = values, table = table, length = len(values))
+    return render_template("account.html", total_cash = total_cash, cash = cash, realized = realized, values = values, table = table, length = len(values))
+
+
+#live price and position value updates for the account page
+@views.route("/account/stream")
+@login_required
+def accountStream():
+    user_id = session['user_id']
+
+    def load_positions():
+        con = get_db()
+        cash = con.execute("SELECT cash FROM users WHERE id = ?;", (user_id,)).fetchone()[0]
+        rows = con.execute("SELECT symbol, shares FROM userStock WHERE id = ? AND shares > 0;", (user_id,))
+        return cash, dict(rows.fetchall())
+
+    events = portfolio_events(fanout, load_positions)
+    return Response(stream_with_context(events), mimetype = "text/event-stream", headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+#daily OHLC bars from the local price store, for charts
+@views.route("/api/prices/<symbol>")
+@login_required
+def priceHistory(symbol):
+    start = ledger.parse_date(request.args.get("start"))
+    end = ledger.parse_date(request.args.get("end"))
+    if (request.args.get("start") and start is None) or (request.args.get("end") and end is None):
+        return jsonify(error = "Dates must look like YYYY-MM-DD"), 400
+
+    bars = price_store.read(symbol.upper(), start, end)
+    return jsonify([
+        {"date": str(day), "open": float(bar["open"]), "high": float(bar["high"]), "low": float(bar["low"]), "close": float(bar["close"]), "volume": int(bar["volume"])}
+        for day, bar in zip(bar_dates(bars), bars)
+    ])
+
+#equity curve, returns and drawdown since the first trade
+@views.route("/performance")
+@login_required
+def performance():
+    results = user_performance(get_db(), session['user_id'])
+    if results is None:
+        return render_template("performance.html", results = None)
+
+    #polyline points for the equity chart, scaled into a 1000x300 box
+    equity = results["equity"]
+    low, high = min(equity), max(equity)
+    step = 1000 / max(len(equity) - 1, 1)
+    points = " ".join(f"{i * step:.1f},{300 - (value - low) / ((high - low) or 1) * 300:.1f}" for i, value in enumerate(equity))
+
+    return render_template("performance.html", results = results, points = points, low = low, high = high)
+
+@views.route("/api/performance")
+@login_required
+def performanceApi():
+    return jsonify(user_performance(get_db(), session['user_id']))
 
 
 @views.route("/changeMoney", methods = ["GET","POST"])
 @login_required
 def changeMoney():
 
-    con = sqlite3.connect("database.db")
+    con = get_db()
     db = con.cursor()
     
     #if method is post
@@ -334,23 +467,58 @@ def changeMoney():
     else:
         return render_template("changeMoney.html")
 
+#history pages only change when the user's transactions do
+def history_version():
+    user_id = session['user_id']
+    return user_id, data_version(get_db(), f"transactions:{user_id}")
+
+def last_trade():
+    latest = get_db().execute("SELECT MAX(time) FROM transactions WHERE user_id = ?;", (session['user_id'],)).fetchone()[0]
+    return datetime.strptime(latest, TIME_FORMAT) if latest else None
+
 @views.route("/history")
 @login_required
+@conditional(history_version, last_trade)
 def history():
-    con = sqlite3.connect("database.db")
-    db = con.cursor()
+    con = get_db()
     user_id = session['user_id']
-    db.execute("SELECT symbol,name,shares,price,time FROM transactions WHERE user_id=?;", (user_id,))
-    values = db.fetchall()
+
+    #filters, all optional
+    symbol = request.args.get("symbol", "").strip().upper()
+    start = ledger.parse_date(request.args.get("start"))
+    end = ledger.parse_date(request.args.get("end"))
+    before = request.args.get("before", type = int)
+
+    rows, next_before = ledger.history_page(con, user_id, symbol, start, end, before)
+    values = [row[1:] for row in rows]
     length = len(values)
 
-    return render_template("history.html", values = values, length = length)
+    filters = {"symbol": symbol, "start": request.args.get("start", ""), "end": request.args.get("end", "")}
+    return render_template("history.html", values = values, length = length, filters = filters, next_before = next_before)
+
+#download the whole (filtered) history, streamed straight from the cursor
+@views.route("/history/export")
+@login_required
+def historyExport():
+    con = get_db()
+    user_id = session['user_id']
+
+    symbol = request.args.get("symbol", "").strip().upper()
+    start = ledger.parse_date(request.args.get("start"))
+    end = ledger.parse_date(request.args.get("end"))
+    rows = ledger.iter_transactions(con, user_id, symbol, start, end)
+
+    if request.args.get("format") == "ndjson":
+        body, mimetype, filename = ledger.ndjson_lines(rows), "application/x-ndjson", "history.ndjson"
+    else:
+        body, mimetype, filename = ledger.csv_lines(rows), "text/csv", "history.csv"
+
+    return Response(stream_with_context(body), mimetype = mimetype, headers = {"Content-Disposition": f"attachment; filename={filename}"})
 
 @views.route("/buy", methods = ["GET", "POST"])
 @login_required
 def buy():
-    con = sqlite3.connect("database.db")
-    db = con.cursor()
+    con = get_db()
 
     #if method is post
     if request.method == "POST":
@@ -365,8 +533,15 @@ def buy():
 
         symbol = request.form.get("symbol").strip().upper()
 
+        #if symbol isn't listed, don't spend an IEX call on it
+        if not symbol_index.refresh(con).has(symbol):
+            flash("Please enter in a valid symbol", category = "error")
+            return redirect("/buy")
+
+        results = current_quote(symbol)
+
         #if symbol is invalid
-        if lookup(symbol) is None:
+        if results is None:
             flash("Please enter in a valid symbol", category = "error")
             return redirect("/buy")
 
@@ -382,8 +557,6 @@ def buy():
             flash("Please enter in a value greater than 0", category = "error")
             return redirect("/buy")
 
-        results = lookup(symbol)
-
         #current price of stock
         stock_price = round(results['price'],2)
 
@@ -393,47 +566,18 @@ def buy():
         #id of current user
         user_id = session["user_id"]
 
-        #current cash user owns
-        db.execute("SELECT cash FROM users WHERE id = ?;", (user_id,))
-        current_cash = db.fetchall()[0][0]
-
-        #total price of everything
-        total_price = stock_price * buy_shares
-
-        #if user has enough money
-        if current_cash>=total_price:
+        #limit and stop orders rest until the price reaches them
+        order_type = request.form.get("order_type", "market")
+        if order_type != "market":
+            return place_order(con, user_id, symbol, name, "buy", order_type, buy_shares, results)
 
-            #update user's cash
-            db.execute("UPDATE users SET cash = ? WHERE id = ?;", (current_cash - total_price, user_id))
-            con.commit()
-
-            #calculate time
-            now = datetime.now()
-            date_time = now.strftime("%m/%d/%Y %H:%M:%S")
-
-            #if there is an entry already for this symbol in the userStock table for this user
-            db.execute("SELECT symbol,shares FROM userStock WHERE id = ?;", (user_id,))
-            table = db.fetchall()
+        #debit cash, add the shares and record the transaction in one go
+        try:
+            execute_buy(con, user_id, symbol, name, buy_shares, stock_price)
 
-            flag = True
-            
-            for i in range(len(table)):
-                if table[i][0] == symbol:
-                    table_shares = table[i][1]
-                    db.execute("UPDATE userStock SET shares = ? WHERE id = ? AND symbol = ?;", (table_shares + buy_shares, user_id, symbol))
-                    con.commit()
-                    flag = False
-                    break
-
-            if flag:
-                db.execute("INSERT INTO userStock (id,symbol,name,shares) VALUES(?,?,?,?)", (user_id, symbol, name, buy_shares))
-                con.commit()
-            db.execute("INSERT INTO transactions (user_id,symbol,name,shares,price,time) VALUES(?,?,?,?,?,?)", (user_id, symbol, name, buy_shares, stock_price, date_time))
-            con.commit()
-        
         #if not enough money
-        else:
-            flash("You do not have enough money", category="error")
+        except TradeError as error:
+            flash(str(error), category="error")
             return redirect("/buy")
 
         flash("Bought!", category="success")
@@ -447,31 +591,22 @@ def buy():
 @views.route("/sell", methods = ["GET", "POST"])
 @login_required
 def sell():
-    con = sqlite3.connect("database.db")
+    con = get_db()
     db = con.cursor()
 
-    #get all symbols and shares
+    #get all open positions
     user_id = session['user_id']
-    db.execute("SELECT symbol,name,shares FROM userStock WHERE id = ?;", (user_id,))
-    rows = db.fetchall()
-
-    #if user has any stock with 0 shares
-    for index in range(len(rows)):
-        if rows[index][2] == 0:
-            #remove the row from table
-            symbol = rows[index][0]
-            db.execute("DELETE FROM userStock WHERE symbol = ? AND id = ?;", (symbol, user_id))
-            con.commit()
-
-    db.execute("SELECT symbol, name, shares FROM userStock WHERE id = ?;", (user_id,))
+    db.execute("SELECT symbol, name, shares FROM userStock WHERE id = ? AND shares > 0;", (user_id,))
     values = db.fetchall()
     table = {}
+    names = {}
 
     for i in range(len(values)):
         symbol = values[i][0]
         shares = values[i][2]
 
         table[symbol] = shares
+        names[symbol] = values[i][1]
 
     #if method is post
     if request.method == "POST":
@@ -513,29 +648,22 @@ def sell():
                     flash("You don't own that many shares of this company", category = "error")
                     return redirect("/sell")
                 else:
+                    #limit and stop orders rest until the price reaches them
+                    order_type = request.form.get("order_type", "market")
+                    if order_type != "market":
+                        return place_order(con, user_id, symbol, names[symbol], "sell", order_type, sell_shares, current_quote(symbol))
+
                     #current price and name of stock
-                    values = lookup(symbol)
+                    values = current_quote(symbol)
                     stock_price = values['price']
                     name = values['name']
-                    total = sell_shares * stock_price
-
-                    #take away shares from userStock
-                    db.execute("UPDATE userStock SET shares = ? WHERE id = ? AND symbol = ?;", (current_shares - sell_shares, user_id, symbol))
-                    con.commit()
 
-                    #add cash to user
-                    db.execute("SELECT cash FROM users WHERE id = ?;", (user_id,))
-                    cash = db.fetchall()[0][0]
-                    db.execute("UPDATE users SET cash = ? WHERE id = ?;", (cash + total, user_id))
-                    con.commit()
-
-                    #add data into transactions
-                    now = datetime.now()
-                    date_time = now.strftime("%d/%m/%Y %H:%M:%S")
-
-                    db.execute("INSERT INTO transactions (user_id, symbol, name, shares, price, time) VALUES (?,?,?,?,?,?)", (user_id, symbol, name, -1 * sell_shares, stock_price, date_time))
-                    con.commit()
-        con.close()           
+                    #take away shares, add cash and record the transaction in one go
+                    try:
+                        execute_sell(con, user_id, symbol, name, sell_shares, stock_price)
+                    except TradeError as error:
+                        flash(str(error), category = "error")
+                        return redirect("/sell")
         flash("Sold!", category = "success")
         return redirect("/account")
     
@@ -544,10 +672,118 @@ def sell():
         return render_template("sell.html", values = values, length = len(values))
 
 
+#store a limit or stop order from the buy/sell form, filling it at once if the current price already crosses it
+def place_order(con, user_id, symbol, name, side, kind, shares, quote):
+    try:
+        trigger = float(request.form.get("limit_price", "").strip())
+        #float() takes "nan" and "inf" too
+        if not math.isfinite(trigger):
+            raise ValueError(trigger)
+    except ValueError:
+        flash("Please enter a limit/stop price (no $ etc)", category = "error")
+        return redirect(f"/{side}")
+
+    try:
+        order_id = orders.place(con, user_id, symbol, name, side, kind, shares, trigger)
+    except TradeError as error:
+        flash(str(error), category = "error")
+        return redirect(f"/{side}")
+    track(symbol)
+
+    status, note = orders.check(con, order_id, symbol, quote)
+    if status == "filled":
+        flash("Order placed and filled!", category = "success")
+    elif status == "rejected":
+        flash(f"Order rejected: {note}", category = "error")
+    else:
+        flash("Order placed!", category = "success")
+    return redirect("/orders")
+
+
+@views.route("/orders")
+@login_required
+def ordersPage():
+    open_orders, closed_orders = orders.user_orders(get_db(), session['user_id'])
+    return render_template("orders.html", open_orders = open_orders, closed_orders = closed_orders)
+
+@views.route("/orders/cancel", methods = ["POST"])
+@login_required
+def cancelOrder():
+    order_id = request.form.get("order_id", type = int)
+    if order_id is None or not orders.cancel(get_db(), session['user_id'], order_id):
+        flash("That order can't be cancelled any more", category = "error")
+    else:
+        flash("Order cancelled", category = "success")
+    return redirect("/orders")
+
+#richest accounts by cash plus holdings, and where the current user stands
+@views.route("/leaderboard")
+@login_required
+def leaderboardPage():
+    board = leaderboard.board
+    if board is None:
+        return render_template("leaderboard.html", top = [], me = None, size = 0)
+    size = max(1, min(request.args.get("n", 25, type = int), 100))
+    return render_template("leaderboard.html", top = board.top(size), me = board.rank(session['user_id']), size = len(board))
+
+#legs accepted in one basket
+BASKET_LIMIT = int(os.environ.get("BASKET_LIMIT", 100))
+
+#market orders for many symbols in one request: {"orders": [{"symbol": "AAPL", "side": "buy", "shares": 10}, ...]}
+#every symbol is priced in one batch, and the basket is filled completely or not at all
+@views.route("/api/orders", methods = ["POST"])
+@login_required
+def basketOrders():
+    body = request.get_json(silent = True)
+    legs = body.get("orders") if isinstance(body, dict) else body
+    if not isinstance(legs, list) or not legs:
+        return jsonify({"error": "Please send a list of orders"}), 400
+    if len(legs) > BASKET_LIMIT:
+        return jsonify({"error": f"A basket can have at most {BASKET_LIMIT} orders"}), 400
+
+    #check the shape of every leg before pricing anything
+    con = get_db()
+    index = symbol_index.refresh(con)
+    parsed = []
+    for i, leg in enumerate(legs):
+        if not isinstance(leg, dict):
+            return jsonify({"error": "Each order needs a symbol, side and shares", "leg": i}), 400
+        symbol = str(leg.get("symbol") or "").strip().upper()
+        side = leg.get("side")
+        shares = leg.get("shares")
+        if side not in ("buy", "sell"):
+            return jsonify({"error": "Side must be buy or sell", "leg": i}), 400
+        if isinstance(shares, bool) or not isinstance(shares, int) or shares <= 0:
+            return jsonify({"error": "Please enter a whole number of shares greater than 0", "leg": i}), 400
+        if not index.has(symbol):
+            return jsonify({"error": f"{symbol or 'Missing symbol'} is not a valid symbol", "leg": i}), 400
+        parsed.append((side, symbol, shares))
+
+    #one batch for every symbol in the basket
+    quotes = current_quotes(list(dict.fromkeys(symbol for side, symbol, shares in parsed)))
+    for i, (side, symbol, shares) in enumerate(parsed):
+        if quotes.get(symbol) is None:
+            return jsonify({"error": f"No price for {symbol}", "leg": i}), 400
+
+    basket = [(side, symbol, quotes[symbol]["name"], shares, round(quotes[symbol]["price"], 2)) for side, symbol, shares in parsed]
+    user_id = session["user_id"]
+    try:
+        totals = execute_basket(con, user_id, basket)
+    except TradeError as error:
+        return jsonify({"error": str(error)}), 400
+
+    cash = con.execute("SELECT cash FROM users WHERE id = ?;", (user_id,)).fetchone()[0]
+    return jsonify({
+        "fills": [{"symbol": symbol, "side": side, "shares": shares, "price": price, "total": total}
+                  for (side, symbol, name, shares, price), total in zip(basket, totals)],
+        "cash": round(cash, 2)
+    })
+
+
 @views.route("/changePassword", methods = ["GET", "POST"])
 @login_required
 def changePassword():
-    con = sqlite3.connect("database.db")
+    con = get_db()
     db = con.cursor()
 
     #if method is post
@@ -578,11 +814,17 @@ def changePassword():
         db.execute("SELECT hash FROM users WHERE id = ?;", (user_id,))
         rows = db.fetchall()[0][0]
 
-        #new pass hashed
-        confirm_pass_hashed = generate_password_hash(confirm_pass)
+        #check if user entered correct current pass, hashing happens in the hashing pool
+        try:
+            matches = hasher.verify(rows, current_pass)[0]
+            if matches:
+                #new pass hashed
+                confirm_pass_hashed = hasher.hash(confirm_pass)
+        except PasswordBusy as error:
+            flash(str(error), category = "error")
+            return redirect("/changePassword")
 
-        #check if user entered correct current pass
-        if check_password_hash(rows, current_pass):
+        if matches:
             
             #if yes, change password to new password
             db.execute("UPDATE users SET hash = ? WHERE id = ?;", (confirm_pass_hashed, user_id))
@@ -593,7 +835,6 @@ def changePassword():
             flash("You entered the wrong current password", category = "error")
             return redirect("/changePassword")
         
-        con.close()
         flash("Password successfully changed!", category = "success")
         return redirect("/login")
 
@@ -601,6 +842,20 @@ def changePassword():
     else:
         return render_template("changePassword.html")
 
+#autocomplete for the symbol boxes, ranked prefix matches on symbol and company name
+@views.route("/api/search")
+@login_required
+def search():
+    q = request.args.get("q", "")
+    limit = min(request.args.get("limit", 10, type = int), 50)
+    return jsonify(symbol_index.refresh(get_db()).search(q, limit))
+
+#quote cache counters, used to tune QUOTE_TTL against the IEX credit budget
+@views.route("/api/quote-stats")
+@login_required
+def quoteStats():
+    return jsonify(quote_cache.stats())
+
 @views.route("/logout")
 @login_required
 def logout():